@@ -1,15 +1,149 @@
 import os
+import pickle
 import argparse
+import functools
+from pathlib import Path
 import rasterio
 import numpy as np
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-from cartopy.feature import NaturalEarthFeature
+import cv2
+from PIL import Image
+from pyproj import Transformer
+from cartopy.io import shapereader
+
+# 禁用Pillow的像素限制，以处理大图
+Image.MAX_IMAGE_PIXELS = None
+
+# 投影后的海岸线顶点缓存文件，避免每次运行都重新解析shapefile并重投影
+COASTLINE_CACHE_PATH = Path('~/.cache/fy4b/coast_3857.pkl').expanduser()
+
+@functools.lru_cache(maxsize=1)
+def load_coastline_vertices_3857():
+    """
+    读取Natural Earth 10m海岸线，并将每条线的顶点一次性投影到Web墨卡托。
+    结果以pickle形式缓存到磁盘，后续运行直接加载，省去约20秒的解析与重投影。
+    返回 [np.ndarray(N,2)] 顶点数组列表。
+    """
+    if COASTLINE_CACHE_PATH.exists():
+        try:
+            return pickle.loads(COASTLINE_CACHE_PATH.read_bytes())
+        except Exception as e:
+            print(f"Warning: Failed to load coastline cache ({e}), rebuilding it.")
+
+    shp_path = shapereader.natural_earth(resolution='10m', category='physical', name='coastline')
+    transformer = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
+    vertex_arrays = []
+    for geom in shapereader.Reader(shp_path).geometries():
+        lines = geom.geoms if hasattr(geom, 'geoms') else [geom]
+        for line in lines:
+            coords = np.asarray(line.coords, dtype=np.float64)
+            x, y = transformer.transform(coords[:, 0], coords[:, 1])
+            vertex_arrays.append(np.stack([x, y], axis=1).astype(np.float32))
+
+    try:
+        COASTLINE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        COASTLINE_CACHE_PATH.write_bytes(pickle.dumps(vertex_arrays, protocol=5))
+    except OSError as e:
+        print(f"Warning: Failed to write coastline cache: {e}")
+    return vertex_arrays
+
+def _composite_coastlines_cv2(image, polylines):
+    """OpenCV路径：绘制阴影层（黑色，alpha=0.6）与白色描边层。"""
+    shadow_layer = image.copy()
+    cv2.polylines(shadow_layer, polylines, isClosed=False, color=(0, 0, 0), thickness=2, lineType=cv2.LINE_AA)
+    image = cv2.addWeighted(shadow_layer, 0.6, image, 0.4, 0)
+    cv2.polylines(image, polylines, isClosed=False, color=(255, 255, 255), thickness=1, lineType=cv2.LINE_AA)
+    return image
+
+def _composite_coastlines_gpu(image, polylines):
+    """
+    GPU路径（FY4B_GPU=1且安装了cupy时启用）：
+    笔画掩膜用OpenCV栅格化一次，逐像素的alpha混合搬到GPU上并行完成。
+    失败时返回None，由调用方回退OpenCV路径。
+    """
+    try:
+        import cupy as cp
+    except ImportError:
+        print("Warning: FY4B_GPU is set but cupy is not installed. Falling back to CPU compositing.")
+        return None
+
+    try:
+        shadow_mask = np.zeros(image.shape[:2], dtype=np.uint8)
+        stroke_mask = np.zeros(image.shape[:2], dtype=np.uint8)
+        cv2.polylines(shadow_mask, polylines, isClosed=False, color=255, thickness=2, lineType=cv2.LINE_AA)
+        cv2.polylines(stroke_mask, polylines, isClosed=False, color=255, thickness=1, lineType=cv2.LINE_AA)
+
+        img_gpu = cp.asarray(image, dtype=cp.float32)
+        shadow_a = cp.asarray(shadow_mask, dtype=cp.float32)[..., None] * (0.6 / 255.0)
+        stroke_a = cp.asarray(stroke_mask, dtype=cp.float32)[..., None] / 255.0
+        img_gpu *= 1.0 - shadow_a                                # 黑色阴影
+        img_gpu = img_gpu * (1.0 - stroke_a) + 255.0 * stroke_a  # 白色描边
+        return cp.asnumpy(cp.clip(cp.rint(img_gpu), 0, 255).astype(cp.uint8))
+    except Exception as e:
+        print(f"Warning: GPU compositing failed ({e}). Falling back to CPU compositing.")
+        return None
+
+def _composite_coastlines_numba(image, polylines):
+    """
+    Numba路径（FY4B_USE_NUMBA=1且安装了numba时启用）：
+    对每条线段只遍历其包围盒内的像素，用点到线段距离场一次性算出
+    阴影与描边的覆盖率，再做单次alpha混合。失败时返回None回退OpenCV。
+    """
+    try:
+        import numba
+    except ImportError:
+        print("Warning: FY4B_USE_NUMBA is set but numba is not installed. Falling back to OpenCV.")
+        return None
+
+    @numba.njit(cache=True, fastmath=True)
+    def _stroke_coverage(segments, height, width, shadow_r, stroke_r):
+        shadow_cov = np.zeros((height, width), dtype=np.float32)
+        stroke_cov = np.zeros((height, width), dtype=np.float32)
+        pad = shadow_r + 1.0
+        for s in range(segments.shape[0]):
+            x0, y0, x1, y1 = segments[s]
+            xmin = max(0, int(min(x0, x1) - pad))
+            xmax = min(width - 1, int(max(x0, x1) + pad))
+            ymin = max(0, int(min(y0, y1) - pad))
+            ymax = min(height - 1, int(max(y0, y1) + pad))
+            dx = x1 - x0
+            dy = y1 - y0
+            seg_len2 = dx * dx + dy * dy
+            for y in range(ymin, ymax + 1):
+                for x in range(xmin, xmax + 1):
+                    if seg_len2 > 0.0:
+                        t = ((x - x0) * dx + (y - y0) * dy) / seg_len2
+                        t = min(1.0, max(0.0, t))
+                    else:
+                        t = 0.0
+                    ddx = x - (x0 + t * dx)
+                    ddy = y - (y0 + t * dy)
+                    d = (ddx * ddx + ddy * ddy) ** 0.5
+                    a_shadow = min(1.0, max(0.0, shadow_r + 0.5 - d))
+                    a_stroke = min(1.0, max(0.0, stroke_r + 0.5 - d))
+                    if a_shadow > shadow_cov[y, x]:
+                        shadow_cov[y, x] = a_shadow
+                    if a_stroke > stroke_cov[y, x]:
+                        stroke_cov[y, x] = a_stroke
+        return shadow_cov, stroke_cov
+
+    try:
+        segments = np.concatenate([
+            np.concatenate([pts[:-1], pts[1:]], axis=1).astype(np.float32)
+            for pts in polylines if len(pts) >= 2
+        ])
+        shadow_cov, stroke_cov = _stroke_coverage(segments, image.shape[0], image.shape[1], 1.0, 0.5)
+        out = image.astype(np.float32)
+        out *= 1.0 - 0.6 * shadow_cov[..., None]                       # 黑色阴影
+        out = out * (1.0 - stroke_cov[..., None]) + 255.0 * stroke_cov[..., None]  # 白色描边
+        return np.clip(np.rint(out), 0, 255).astype(np.uint8)
+    except Exception as e:
+        print(f"Warning: Numba compositing failed ({e}). Falling back to OpenCV.")
+        return None
 
 def add_boundaries_to_geotiff(input_geotiff, output_png):
     """
-    读取GeoTIFF，在其上叠加高精度海岸线，并保存为与其具有相同分辨率的PNG。
+    读取GeoTIFF，在其上直接栅格化高精度海岸线，并保存为与其具有相同分辨率的PNG。
+    不经过Matplotlib/Cartopy绘图管线，直接用OpenCV在像素数组上描边。
     """
     print(f"--- Step 1: Reading GeoTIFF: {input_geotiff} ---")
     if not os.path.exists(input_geotiff):
@@ -17,83 +151,89 @@ def add_boundaries_to_geotiff(input_geotiff, output_png):
         return
 
     try:
-        with rasterio.open(input_geotiff) as src:
-            if src.crs.to_epsg() != 3857:
-                print(f"Error: Input GeoTIFF is not in Web Mercator (EPSG:3857) projection. Found: {src.crs.to_string()}")
-                return
-
-            image_data = src.read()
-            if image_data.shape[0] == 4:
-                image_data = image_data[:3, :, :]
-            
-            image_for_plot = np.transpose(image_data, (1, 2, 0))
-            
-            bounds = src.bounds
-            image_extent = [bounds.left, bounds.right, bounds.bottom, bounds.top]
-            
-            height, width = src.height, src.width
-            print(f"Input Image Dimensions: {width}x{height}")
+        src = rasterio.open(input_geotiff)
+        if src.crs.to_epsg() != 3857:
+            print(f"Error: Input GeoTIFF is not in Web Mercator (EPSG:3857) projection. Found: {src.crs.to_string()}")
+            src.close()
+            return
+
+        bands = [1, 2, 3] if src.count >= 3 else list(range(1, src.count + 1))
+        bounds = src.bounds
+        height, width = src.height, src.width
+        print(f"Input Image Dimensions: {width}x{height}")
 
     except Exception as e:
         print(f"Error reading GeoTIFF file: {e}")
         return
 
-    # --- 精确控制输出分辨率 ---
-    print("--- Step 2: Preparing high-fidelity plot ---")
-    
-    # 1. 设置一个固定的DPI
-    dpi = 100  # 使用一个简单的整数便于计算
-
-    # 2. 根据输入图像的像素尺寸和DPI，反向计算出 Matplotlib 的 figsize (英寸)
-    # figsize = (width_pixels / dpi, height_pixels / dpi)
-    figsize = (width / dpi, height / dpi)
-    
-    print(f"Calculated figure size: {figsize[0]:.2f}x{figsize[1]:.2f} inches at {dpi} DPI.")
-
-    # 3. 创建图形，确保它没有默认的边框和填充
-    fig = plt.figure(figsize=figsize, dpi=dpi, frameon=False)
-
-    # 4. 创建一个填满整个图形的地图轴 (axes)
-    # [0, 0, 1, 1] 表示从左下角(0,0)开始，宽度和高度都占100%
-    map_projection = ccrs.Mercator()
-    ax = fig.add_axes([0, 0, 1, 1], projection=map_projection)
-
-    # 5. 移除轴本身的所有边框和填充
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.spines['left'].set_visible(False)
-    ax.get_xaxis().set_visible(False)
-    ax.get_yaxis().set_visible(False)
-
-    # 6. 设置地图的地理范围
-    ax.set_extent(image_extent, crs=map_projection)
-    
-    # 7. 绘制原始图像，数据未经任何改动
-    ax.imshow(image_for_plot, origin='upper', extent=image_extent, transform=map_projection)
-
-    # 8. 添加高精度海岸线
-    print("--- Step 3: Adding high-resolution boundaries ---")
-    coastline_10m = NaturalEarthFeature('physical', 'coastline', '10m')
-
-    # 绘制阴影层
-    ax.add_feature(coastline_10m, edgecolor='black', facecolor='none', linewidth=1.5, alpha=0.6, zorder=10)
-    # 绘制白色描边层
-    ax.add_feature(coastline_10m, edgecolor='white', facecolor='none', linewidth=0.8, zorder=11)
-    
-    print(f"--- Step 4: Saving output PNG with original resolution to: {output_png} ---")
-    
-    # 9. 保存PNG，使用与计算figsize时相同的DPI
-    # bbox_inches='tight' 和 pad_inches=0 是双重保险，确保无白边
-    plt.savefig(
-        output_png, 
-        dpi=dpi,
-        bbox_inches='tight',
-        pad_inches=0,
-        transparent=True
+    print("--- Step 2: Loading and projecting coastline geometries ---")
+    vertex_arrays = load_coastline_vertices_3857()
+
+    # 先用包围盒剔除落在图像范围之外的海岸线，FY-4B裁剪区只覆盖全球的一小部分
+    bboxes = np.array([[a[:, 0].min(), a[:, 1].min(), a[:, 0].max(), a[:, 1].max()] for a in vertex_arrays])
+    in_extent = (
+        (bboxes[:, 0] <= bounds.right) & (bboxes[:, 2] >= bounds.left) &
+        (bboxes[:, 1] <= bounds.top) & (bboxes[:, 3] >= bounds.bottom)
     )
-    
-    plt.close(fig)
+    vertex_arrays = [vertex_arrays[i] for i in np.flatnonzero(in_extent)]
+    print(f"Coastline segments within extent: {len(vertex_arrays)} / {len(in_extent)}")
+
+    # 将墨卡托坐标换算为像素坐标
+    res_x = (bounds.right - bounds.left) / width
+    res_y = (bounds.top - bounds.bottom) / height
+    polylines = []
+    for pts in vertex_arrays:
+        px = np.round((pts[:, 0] - bounds.left) / res_x).astype(np.int32)
+        py = np.round((bounds.top - pts[:, 1]) / res_y).astype(np.int32)
+        polylines.append(np.stack([px, py], axis=1))
+
+    strip_rows = int(os.getenv('FY4B_STRIP_ROWS', 0))
+    if strip_rows > 0:
+        # 流式模式：按条带读入+合成，解码与阴影混合的临时缓冲被限制在条带大小
+        print(f"--- Step 3: Reading and compositing in strips of {strip_rows} rows ---")
+        from rasterio.windows import Window
+
+        image = np.empty((height, width, len(bands)), dtype=np.uint8)
+        y_ranges = np.array([[p[:, 1].min(), p[:, 1].max()] for p in polylines]) if polylines else np.empty((0, 2))
+        stroke_pad = 4  # 笔画宽度留余量，跨条带的线不被截断
+        for y0 in range(0, height, strip_rows):
+            rows = min(strip_rows, height - y0)
+            strip = image[y0:y0 + rows]
+            src.read(bands, out=strip.transpose(2, 0, 1), window=Window(0, y0, width, rows))
+            hit = (y_ranges[:, 0] <= y0 + rows + stroke_pad) & (y_ranges[:, 1] >= y0 - stroke_pad)
+            strip_polylines = [polylines[i] - np.array([0, y0], dtype=np.int32) for i in np.flatnonzero(hit)]
+            if strip_polylines:
+                strip[:] = _composite_coastlines_cv2(strip, strip_polylines)
+        src.close()
+        print(f"--- Step 4: Saving output PNG with original resolution to: {output_png} ---")
+        Image.fromarray(image).save(output_png)
+        return
+
+    # 只解码RGB波段，并让rasterio直接写入HWC连续缓冲的CHW视图，免去转置拷贝
+    image = np.empty((height, width, len(bands)), dtype=np.uint8)
+    src.read(bands, out=image.transpose(2, 0, 1))
+    src.close()
+
+    if os.getenv('FY4B_GPU'):
+        print("--- Step 3: Rasterizing boundaries with GPU compositing ---")
+        gpu_image = _composite_coastlines_gpu(image, polylines)
+        if gpu_image is not None:
+            image = gpu_image
+        else:
+            image = _composite_coastlines_cv2(image, polylines)
+    elif os.getenv('FY4B_USE_NUMBA'):
+        print("--- Step 3: Rasterizing boundaries with Numba distance-field kernel ---")
+        numba_image = _composite_coastlines_numba(image, polylines)
+        if numba_image is not None:
+            image = numba_image
+        else:
+            image = _composite_coastlines_cv2(image, polylines)
+    else:
+        print("--- Step 3: Rasterizing boundaries with OpenCV ---")
+        image = _composite_coastlines_cv2(image, polylines)
+
+    print(f"--- Step 4: Saving output PNG with original resolution to: {output_png} ---")
+    Image.fromarray(image).save(output_png)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -121,4 +261,4 @@ if __name__ == "__main__":
 
     add_boundaries_to_geotiff(args.input_geotiff, output_path)
 
-    print(f"\n✅ All done! High-fidelity image with boundaries saved to: {os.path.abspath(output_path)}")
\ No newline at end of file
+    print(f"\n✅ All done! High-fidelity image with boundaries saved to: {os.path.abspath(output_path)}")
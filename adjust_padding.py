@@ -8,9 +8,100 @@ from dotenv import load_dotenv
 # 禁用Pillow的像素限制，以处理大图
 Image.MAX_IMAGE_PIXELS = None
 
+# imagecodecs的libdeflate+SIMD解滤波解码PNG比原生Pillow快2-4倍，可选依赖
+try:
+    import imagecodecs
+except ImportError:
+    imagecodecs = None
+
+# numba可选：把阈值比较和包围盒归约融合成单遍并行扫描，无中间掩码数组
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _bbox_kernel(arr, threshold):
+        """单遍求内容包围盒；每行从两端向内找首个内容像素后即停。"""
+        H, W = arr.shape
+        top, bottom, left, right = H, -1, W, -1
+        for i in numba.prange(H):
+            row = arr[i]
+            l = W
+            for j in range(W):
+                if row[j] > threshold:
+                    l = j
+                    break
+            if l < W:
+                r = l
+                for j in range(W - 1, l - 1, -1):
+                    if row[j] > threshold:
+                        r = j
+                        break
+                top = min(top, i)
+                bottom = max(bottom, i)
+                left = min(left, l)
+                right = max(right, r)
+        return top, bottom, left, right
+
+def _load_image_array(path):
+    """解码图像为numpy数组，优先走imagecodecs，否则回退Pillow。"""
+    if imagecodecs is not None:
+        return imagecodecs.imread(path)
+    return np.asarray(Image.open(path))
+
+def _save_png(path, arr):
+    """编码PNG；imagecodecs用level=1快速压缩（中间文件，体积略大无妨）。"""
+    if imagecodecs is not None:
+        imagecodecs.imwrite(path, arr, codec='png', level=1)
+    else:
+        Image.fromarray(arr).save(path)
+
+def _adjust_image_padding_vips(input_image_path, output_image_path, threshold, crop_x, crop_y):
+    """
+    pyvips后端：以流水线方式处理图像，峰值内存只有若干扫描线而非整图。
+    """
+    import pyvips
+
+    probe = pyvips.Image.new_from_file(input_image_path)
+    left, top, w, h = probe.find_trim(threshold=threshold, background=[0, 0, 0])
+    if w == 0 or h == 0:
+        print("Warning: Image appears to be completely empty.")
+        pyvips.Image.new_from_file(input_image_path, access='sequential').write_to_file(output_image_path)
+        return True
+    print(f"Detected content image size: {(w, h)}")
+
+    if crop_x > 0:
+        if 2 * crop_x >= w:
+            print(f"Error: crop_x value ({crop_x}) is too large for image width ({w}).")
+            return False
+        print(f"Applying horizontal crop of {crop_x}px from each side.")
+        left, w = left + crop_x, w - 2 * crop_x
+    if crop_y > 0:
+        if 2 * crop_y >= h:
+            print(f"Error: crop_y value ({crop_y}) is too large for image height ({h}).")
+            return False
+        print(f"Applying vertical crop of {crop_y}px from each side.")
+        top, h = top + crop_y, h - 2 * crop_y
+
+    pad_x = max(0, -crop_x)
+    pad_y = max(0, -crop_y)
+
+    # 重新以sequential模式打开，裁剪+填充+写出作为单次流式扫描完成
+    img = pyvips.Image.new_from_file(input_image_path, access='sequential')
+    out = img.crop(left, top, w, h)
+    if pad_x or pad_y:
+        print(f"Adding padding of {pad_x}px (horizontal) / {pad_y}px (vertical) to each side.")
+        out = out.embed(pad_x, pad_y, w + 2 * pad_x, h + 2 * pad_y, extend='black')
+    out.write_to_file(output_image_path)
+    print(f"Final adjusted size: {(out.width, out.height)}")
+    return True
+
 def adjust_image_padding(input_image_path, output_image_path, threshold=10, crop_x=0, crop_y=0):
     """
     自动裁剪图像周围的黑色内边距，并根据用户输入进行额外的裁剪（正值）或填充（负值）。
+    设置 FY4B_USE_VIPS=1 时走pyvips流式后端（需安装pyvips），否则使用PIL/NumPy路径。
     返回 True 表示成功，False 表示失败。
     """
     print(f"--- Step 1: Processing image: {input_image_path} ---")
@@ -18,64 +109,108 @@ def adjust_image_padding(input_image_path, output_image_path, threshold=10, crop
         print(f"Error: Input file not found at '{input_image_path}'")
         return False
 
+    if os.getenv('FY4B_USE_VIPS'):
+        try:
+            success = _adjust_image_padding_vips(input_image_path, output_image_path, threshold, crop_x, crop_y)
+            if success:
+                print(f"--- Step 2: Saved adjusted image to: {output_image_path} ---")
+            return success
+        except ImportError:
+            print("Warning: FY4B_USE_VIPS is set but pyvips is not installed. Falling back to PIL.")
+        except Exception as e:
+            print(f"An error occurred during adjustment (pyvips): {e}")
+            return False
+
     try:
-        im = Image.open(input_image_path)
-        
         # 1. 自动裁剪核心图像
-        im_gray = im.convert('L')
-        im_array = np.array(im_gray)
-        non_empty_coords = np.where(im_array > threshold)
-        
-        if non_empty_coords[0].size == 0:
+        # 用行/列投影求包围盒，避免np.where物化全部非空像素的坐标数组
+        # 边距是纯黑的，扫第一个通道就够判定内容像素，无需convert('L')灰度
+        # 转换，也省掉另外两个通道的比较与OR（内存流量降为1/3）
+        arr = _load_image_array(input_image_path)
+        full_size = (arr.shape[1], arr.shape[0])
+        channel = arr if arr.ndim == 2 else arr[..., 0]
+
+        if numba is not None and os.getenv('FY4B_USE_NUMBA'):
+            # 融合内核一遍出结果；cache=True让JIT编译只在首次运行时发生
+            top, bottom, left, right = _bbox_kernel(np.ascontiguousarray(channel), threshold)
+            empty = bottom < 0
+        else:
+            # 分层扫描：先在16倍降采样网格上粗定位（触碰的字节数约1/256），
+            # 再只在每条边±16px的窄带内精确化。圆盘内容是稠密的大块区域，
+            # 粗网格必然命中；粗扫为空时退回全分辨率扫描兜底
+            step = 16
+            small = channel[::step, ::step] > threshold
+            rows_s = small.any(axis=1)
+            cols_s = small.any(axis=0)
+            if rows_s.any():
+                H, W = channel.shape[:2]
+                t_c = int(rows_s.argmax()) * step
+                b_c = int(len(rows_s) - 1 - rows_s[::-1].argmax()) * step
+                l_c = int(cols_s.argmax()) * step
+                r_c = int(len(cols_s) - 1 - cols_s[::-1].argmax()) * step
+                t0 = max(0, t_c - step)
+                band = (channel[t0:t_c + 1] > threshold).any(axis=1)
+                top = t0 + int(band.argmax())
+                band = (channel[b_c:min(H, b_c + step + 1)] > threshold).any(axis=1)
+                bottom = b_c + int(len(band) - 1 - band[::-1].argmax())
+                l0 = max(0, l_c - step)
+                band = (channel[:, l0:l_c + 1] > threshold).any(axis=0)
+                left = l0 + int(band.argmax())
+                band = (channel[:, r_c:min(W, r_c + step + 1)] > threshold).any(axis=0)
+                right = r_c + int(len(band) - 1 - band[::-1].argmax())
+                empty = False
+            else:
+                mask = channel > threshold
+                rows_any = mask.any(axis=1)
+                cols_any = mask.any(axis=0)
+                empty = not rows_any.any()
+                if not empty:
+                    top = int(rows_any.argmax())
+                    bottom = int(len(rows_any) - 1 - rows_any[::-1].argmax())
+                    left = int(cols_any.argmax())
+                    right = int(len(cols_any) - 1 - cols_any[::-1].argmax())
+
+        if empty:
             print("Warning: Image appears to be completely empty.")
-            im.save(output_image_path)
+            _save_png(output_image_path, arr)
             return True
-            
-        top = int(np.min(non_empty_coords[0]))
-        bottom = int(np.max(non_empty_coords[0]))
-        left = int(np.min(non_empty_coords[1]))
-        right = int(np.max(non_empty_coords[1]))
         
-        bbox = (left, top, right + 1, bottom + 1)
-        im_core = im.crop(bbox)
-        print(f"Detected content image size: {im_core.size}")
+        core = arr[top:bottom + 1, left:right + 1]
+        print(f"Detected content image size: {(core.shape[1], core.shape[0])}")
 
-        # 2. 应用额外调整
-        im_final = im_core
-        
+        # 2. 应用额外调整（正值=向内裁剪，负值=向外填充），全部在numpy数组上完成
+        h, w = core.shape[:2]
         if crop_x > 0:
-            print(f"Applying horizontal crop of {crop_x}px from each side.")
-            w, h = im_final.size
             if 2 * crop_x >= w:
                 print(f"Error: crop_x value ({crop_x}) is too large for image width ({w}).")
                 return False
-            im_final = im_final.crop((crop_x, 0, w - crop_x, h))
-        elif crop_x < 0:
-            pad_x = abs(crop_x)
-            print(f"Adding horizontal padding of {pad_x}px to each side.")
-            w, h = im_final.size
-            new_canvas = Image.new(im_final.mode, (w + 2 * pad_x, h), (0, 0, 0))
-            new_canvas.paste(im_final, (pad_x, 0))
-            im_final = new_canvas
-
+            print(f"Applying horizontal crop of {crop_x}px from each side.")
+            core = core[:, crop_x:w - crop_x]
         if crop_y > 0:
-            print(f"Applying vertical crop of {crop_y}px from each side.")
-            w, h = im_final.size
             if 2 * crop_y >= h:
                 print(f"Error: crop_y value ({crop_y}) is too large for image height ({h}).")
                 return False
-            im_final = im_final.crop((0, crop_y, w, h - crop_y))
-        elif crop_y < 0:
-            pad_y = abs(crop_y)
-            print(f"Adding vertical padding of {pad_y}px to each side.")
-            w, h = im_final.size
-            new_canvas = Image.new(im_final.mode, (w, h + 2 * pad_y), (0, 0, 0))
-            new_canvas.paste(im_final, (0, pad_y))
-            im_final = new_canvas
-            
-        print(f"Original full size: {im.size}, Final adjusted size: {im_final.size}")
-        
-        im_final.save(output_image_path)
+            print(f"Applying vertical crop of {crop_y}px from each side.")
+            core = core[crop_y:h - crop_y, :]
+
+        pad_x = max(0, -crop_x)
+        pad_y = max(0, -crop_y)
+        if pad_x or pad_y:
+            print(f"Adding padding of {pad_x}px (horizontal) / {pad_y}px (vertical) to each side.")
+            # np.pad会先整幅清零再拷贝；np.empty + 只写四条边带，
+            # 内部大块区域由核心图像的拷贝直接覆盖，不用清零两遍
+            h, w = core.shape[:2]
+            out = np.empty((h + 2 * pad_y, w + 2 * pad_x) + core.shape[2:], dtype=core.dtype)
+            out[pad_y:pad_y + h, pad_x:pad_x + w] = core
+            out[:pad_y] = 0
+            out[pad_y + h:] = 0
+            out[pad_y:pad_y + h, :pad_x] = 0
+            out[pad_y:pad_y + h, pad_x + w:] = 0
+            core = out
+
+        print(f"Original full size: {full_size}, Final adjusted size: {(core.shape[1], core.shape[0])}")
+
+        _save_png(output_image_path, np.ascontiguousarray(core))
         
         print(f"--- Step 2: Saved adjusted image to: {output_image_path} ---")
         return True
@@ -84,6 +219,52 @@ def adjust_image_padding(input_image_path, output_image_path, threshold=10, crop
         print(f"An error occurred during adjustment: {e}")
         return False
 
+def run(timestamp, data_dir, keep_source=False):
+    """
+    裁剪/填充单个时间戳的完整入口，供main_workflow进程内调用。
+    配置仍从环境变量读取，语义与命令行调用一致。返回True/False。
+    """
+    crop_x = int(os.getenv('ADJUST_CROP_X', -135))
+    crop_y = int(os.getenv('ADJUST_CROP_Y', -162))
+    threshold = int(os.getenv('ADJUST_THRESHOLD', 10))
+
+    # --- 自动构建文件路径（下载端可能输出.tif/.jpg/.webp而非.png） ---
+    input_filepath = os.path.join(data_dir, f"fy4b_full_disk_{timestamp}.png")
+    if not os.path.exists(input_filepath):
+        for ext in ('.tif', '.jpg', '.webp'):
+            candidate = os.path.join(data_dir, f"fy4b_full_disk_{timestamp}{ext}")
+            if os.path.exists(candidate):
+                input_filepath = candidate
+                break
+
+    output_filepath = os.path.join(data_dir, f"fy4b_full_disk_{timestamp}_adjusted.png")
+
+    if not os.path.exists(input_filepath):
+        print(f"Error: Input file not found at '{input_filepath}'")
+        return False
+
+    success = adjust_image_padding(
+        input_filepath,
+        output_filepath,
+        threshold=threshold,
+        crop_x=crop_x,
+        crop_y=crop_y
+    )
+
+    if success:
+        print(f"\n✅ Padding adjustment successful.")
+        if not keep_source:
+            try:
+                os.remove(input_filepath)
+                print(f"Successfully deleted source file: {input_filepath}")
+            except OSError as e:
+                print(f"Error deleting source file {input_filepath}: {e}")
+        else:
+            print(f"Source file '{input_filepath}' has been kept as requested.")
+    else:
+        print(f"\n❌ Padding adjustment failed. Source file '{input_filepath}' has been kept for inspection.")
+    return success
+
 if __name__ == "__main__":
     load_dotenv() # 加载 .env 文件
     parser = argparse.ArgumentParser(
@@ -109,43 +290,5 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-
-    # --- 从环境变量读取配置 ---
-    crop_x = int(os.getenv('ADJUST_CROP_X', -135))
-    crop_y = int(os.getenv('ADJUST_CROP_Y', -162))
-    threshold = int(os.getenv('ADJUST_THRESHOLD', 10)) # 顺便也将 threshold 设为可配置
-
-    # --- 自动构建文件路径 ---
-    input_filename = f"fy4b_full_disk_{args.timestamp}.png"
-    input_filepath = os.path.join(args.data_dir, input_filename)
-    
-    output_filename = f"fy4b_full_disk_{args.timestamp}_adjusted.png"
-    output_filepath = os.path.join(args.data_dir, output_filename)
-    
-    # 检查输入文件是否存在
-    if not os.path.exists(input_filepath):
-        print(f"Error: Input file not found at '{input_filepath}'")
-        sys.exit(1)
-
-    # 调用核心处理函数
-    success = adjust_image_padding(
-        input_filepath, 
-        output_filepath, 
-        threshold=threshold,
-        crop_x=crop_x,
-        crop_y=crop_y
-    )
-    
-    if success:
-        print(f"\n✅ Padding adjustment successful.")
-        # --- 根据标志决定是否删除 ---
-        if not args.keep_source:
-            try:
-                os.remove(input_filepath)
-                print(f"Successfully deleted source file: {input_filepath}")
-            except OSError as e:
-                print(f"Error deleting source file {input_filepath}: {e}")
-        else:
-            print(f"Source file '{input_filepath}' has been kept as requested.")
-    else:
-        print(f"\n❌ Padding adjustment failed. Source file '{input_filepath}' has been kept for inspection.")
\ No newline at end of file
+    if not run(args.timestamp, args.data_dir, keep_source=args.keep_source):
+        sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,129 @@
+import os
+import re
+import sys
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+from adjust_padding import adjust_image_padding
+from create_geotiff import create_geotiff_from_image
+
+TIMESTAMP_RE = re.compile(r'fy4b_full_disk_(\d{14})\.png$')
+
+def timestamps_from_glob(pattern):
+    """从匹配到的文件名中提取时间戳（fy4b_full_disk_YYYYMMDDHHMMSS.png）。"""
+    timestamps = []
+    for path in sorted(glob.glob(pattern)):
+        match = TIMESTAMP_RE.search(os.path.basename(path))
+        if match:
+            timestamps.append(match.group(1))
+        else:
+            print(f"Warning: Skipping '{path}', filename does not contain a timestamp.")
+    return timestamps
+
+def _process_one(timestamp, data_dir, with_boundaries=False):
+    """
+    为单个时间戳顺序执行 调整边距 -> 生成GeoTIFF（可选：叠加海岸线）。
+    返回 (timestamp, 是否成功)。
+    """
+    crop_x = int(os.getenv('ADJUST_CROP_X', -135))
+    crop_y = int(os.getenv('ADJUST_CROP_Y', -162))
+    threshold = int(os.getenv('ADJUST_THRESHOLD', 10))
+
+    bbox_config = {
+        "north": float(os.getenv('GEOTIFF_BBOX_NORTH', 55.0)),
+        "south": float(os.getenv('GEOTIFF_BBOX_SOUTH', -55.0)),
+        "west": float(os.getenv('GEOTIFF_BBOX_WEST', 60.0)),
+        "east": float(os.getenv('GEOTIFF_BBOX_EAST', 150.0))
+    }
+    output_width = int(os.getenv('GEOTIFF_OUTPUT_WIDTH', 4096))
+
+    source_png = os.path.join(data_dir, f"fy4b_full_disk_{timestamp}.png")
+    adjusted_png = os.path.join(data_dir, f"fy4b_full_disk_{timestamp}_adjusted.png")
+    output_tif = os.path.join(data_dir, f"fy4b_full_disk_{timestamp}_adjusted_mercator.tif")
+
+    if not os.path.exists(source_png):
+        print(f"[{timestamp}] Error: Input file not found at '{source_png}'")
+        return timestamp, False
+
+    if not adjust_image_padding(source_png, adjusted_png, threshold=threshold, crop_x=crop_x, crop_y=crop_y):
+        return timestamp, False
+    if not create_geotiff_from_image(adjusted_png, output_tif, bbox_config, output_width):
+        return timestamp, False
+
+    if with_boundaries:
+        # 延迟导入：海岸线模块会拉起cartopy/rasterio，只有需要时才付这份导入成本；
+        # 在单进程批处理中，海岸线缓存的lru_cache在各帧之间直接复用
+        from add_boundaries import add_boundaries_to_geotiff
+        boundaries_png = os.path.join(data_dir, f"fy4b_full_disk_{timestamp}_with_coastlines.png")
+        add_boundaries_to_geotiff(output_tif, boundaries_png)
+
+    return timestamp, True
+
+def run_batch(timestamps, data_dir, with_boundaries=False):
+    """
+    批量处理多个时间戳。FY4B_WORKERS>1时用进程池并行；
+    FY4B_WORKERS=1时在当前解释器内顺序执行，GDAL/Cartopy的导入与
+    海岸线数据解析只冷启动一次，由所有帧分摊。
+    """
+    max_workers = int(os.getenv('FY4B_WORKERS', os.cpu_count() or 1))
+    print(f"--- Processing {len(timestamps)} timestamps with {max_workers} workers ---")
+
+    results = {}
+    if max_workers == 1:
+        for ts in timestamps:
+            ts, success = _process_one(ts, data_dir, with_boundaries)
+            results[ts] = success
+            print(f"[{ts}] {'✅ done' if success else '❌ failed'}")
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(_process_one, ts, data_dir, with_boundaries): ts for ts in timestamps}
+            for future in as_completed(futures):
+                ts, success = future.result()
+                results[ts] = success
+                print(f"[{ts}] {'✅ done' if success else '❌ failed'}")
+
+    failed = [ts for ts, ok in results.items() if not ok]
+    if failed:
+        print(f"\n❌ {len(failed)} timestamp(s) failed: {', '.join(sorted(failed))}")
+    else:
+        print("\n✅ All timestamps processed successfully.")
+    return not failed
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description="Processes multiple timestamps (padding adjustment + GeoTIFF creation) in parallel across CPU cores."
+    )
+    parser.add_argument(
+        "timestamps",
+        nargs='*',
+        help="Timestamps to process, in 'YYYYMMDDHHMMSS' format."
+    )
+    parser.add_argument(
+        "--glob",
+        type=str,
+        help="Glob pattern of stitched PNGs to derive timestamps from, e.g. 'data/fy4b_full_disk_*.png'."
+    )
+    parser.add_argument(
+        "--with-boundaries",
+        action="store_true",
+        help="Also render the coastline overlay PNG for each processed GeoTIFF."
+    )
+    parser.add_argument(
+        "-d", "--data-dir",
+        type=str,
+        default='./data',
+        help="The base directory for input and output files. Default: './data'"
+    )
+    args = parser.parse_args()
+
+    timestamps = list(args.timestamps)
+    if args.glob:
+        timestamps.extend(ts for ts in timestamps_from_glob(args.glob) if ts not in timestamps)
+    if not timestamps:
+        parser.error("No timestamps given: pass them as arguments or via --glob.")
+
+    if not run_batch(timestamps, args.data_dir, with_boundaries=args.with_boundaries):
+        sys.exit(1)
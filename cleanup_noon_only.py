@@ -3,7 +3,27 @@ import os
 import json
 import shutil
 import argparse
-from datetime import datetime, timezone, timedelta
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# orjson的SIMD整数解析在长归档上比stdlib json快一个数量级，可选依赖
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _load_json(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def _dump_json(path, obj):
+    if orjson:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w') as f:
+            json.dump(obj, f, indent=2)
 
 def cleanup_timestamps(target_dir, timezone_offset, execute=False):
     """
@@ -24,33 +44,26 @@ def cleanup_timestamps(target_dir, timezone_offset, execute=False):
     print(f"--- 时区标准: UTC{'+' if timezone_offset >= 0 else ''}{timezone_offset} ---")
 
     try:
-        with open(json_path, 'r') as f:
-            all_timestamps = json.load(f)
+        all_timestamps = _load_json(json_path)
         if not isinstance(all_timestamps, list):
             print(f"❌ 错误: 'timestamps.json' 的内容不是一个列表。")
             return
-    except (json.JSONDecodeError, FileNotFoundError) as e:
+    except (ValueError, FileNotFoundError) as e:
         print(f"❌ 错误: 读取或解析 'timestamps.json' 失败: {e}")
         return
 
-    timestamps_to_keep = []
-    timestamps_to_remove = []
-    target_tz = timezone(timedelta(hours=timezone_offset))
-
-    # 1. 分类所有时间戳
+    # 1. 分类所有时间戳（向量化：本地正午 <=> (ts + 偏移) 在当天恰好是 12:00:00）
+    valid_timestamps = []
     for ts in all_timestamps:
         try:
-            # 将Unix时间戳（UTC）转换为指定时区的datetime对象
-            dt_utc = datetime.fromtimestamp(ts, tz=timezone.utc)
-            dt_local = dt_utc.astimezone(target_tz)
-            
-            # 检查是否为中午12:00:00
-            if dt_local.hour == 12 and dt_local.minute == 0 and dt_local.second == 0:
-                timestamps_to_keep.append(ts)
-            else:
-                timestamps_to_remove.append(ts)
+            valid_timestamps.append(int(ts))
         except (ValueError, TypeError) as e:
             print(f"⚠️ 警告: 跳过无效的时间戳 '{ts}': {e}")
+
+    ts_arr = np.asarray(valid_timestamps, dtype=np.int64)
+    is_noon = ((ts_arr + timezone_offset * 3600) % 86400) == 12 * 3600
+    timestamps_to_keep = ts_arr[is_noon].tolist()
+    timestamps_to_remove = ts_arr[~is_noon].tolist()
             
     print("\n--- 分析完成 ---")
     print(f"🔵 将保留 {len(timestamps_to_keep)} 个时间戳 (中午12点)。")
@@ -59,29 +72,37 @@ def cleanup_timestamps(target_dir, timezone_offset, execute=False):
         print("\n无需清理，所有时间戳均符合保留条件。")
         return
 
-    # 2. 移除对应的文件夹
+    # 2. 移除对应的文件夹（unlink系统调用会释放GIL，用线程池并行以掩盖I/O延迟）
     print("\n--- 开始处理文件夹 ---")
+    folders_to_delete = []
     for ts in timestamps_to_remove:
         folder_path = os.path.join(target_dir, str(ts))
         if os.path.isdir(folder_path):
             if execute:
-                try:
-                    shutil.rmtree(folder_path)
-                    print(f"🗑️ 已删除文件夹: {folder_path}")
-                except OSError as e:
-                    print(f"❌ 删除失败: {folder_path} - {e}")
+                folders_to_delete.append(folder_path)
             else:
                 print(f"模拟删除文件夹: {folder_path}")
         else:
             print(f"ℹ️  文件夹不存在，无需删除: {folder_path}")
 
+    if execute and folders_to_delete:
+        def _remove_folder(folder_path):
+            try:
+                shutil.rmtree(folder_path)
+                print(f"🗑️ 已删除文件夹: {folder_path}")
+            except OSError as e:
+                print(f"❌ 删除失败: {folder_path} - {e}")
+
+        max_workers = int(os.getenv('FY4B_RMTREE_WORKERS', 32))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(_remove_folder, folders_to_delete))
+
     # 3. 更新 timestamps.json 文件
     if execute:
         print("\n--- 正在更新 timestamps.json 文件 ---")
         try:
             timestamps_to_keep.sort()
-            with open(json_path, 'w') as f:
-                json.dump(timestamps_to_keep, f, indent=2)
+            _dump_json(json_path, timestamps_to_keep)
             print("✅ 'timestamps.json' 文件更新成功。")
         except IOError as e:
             print(f"❌ 写入 'timestamps.json' 失败: {e}")
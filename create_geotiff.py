@@ -1,9 +1,18 @@
 import os
 import sys
+import hashlib
 import argparse
+from pathlib import Path
+import numpy as np
 from osgeo import gdal, osr
 from dotenv import load_dotenv
 
+# FY-4B地球静止轨道投影参数
+GEOS_PROJ4 = "+proj=geos +h=35785831 +lon_0=104.9 +sweep=x +datum=WGS84 +units=m"
+
+# 预计算重采样查找表的缓存目录（源投影、目标范围、输出宽度固定时逐帧可复用）
+WARP_LUT_CACHE_DIR = Path('~/.cache/fy4b').expanduser()
+
 def transform_bbox_4326_to_3857(bbox):
     """将WGS84经纬度边界框转换为Web墨卡托坐标。"""
     srs_4326 = osr.SpatialReference()
@@ -21,6 +30,145 @@ def transform_bbox_4326_to_3857(bbox):
     
     return [min_x, min_y, max_x, max_y]
 
+def _warp_lut_path(src_width, src_height, output_bounds, output_width):
+    """根据源尺寸与目标网格参数生成查找表缓存文件路径。"""
+    key = f"{src_width}x{src_height}:{output_bounds}:{output_width}:{GEOS_PROJ4}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+    return WARP_LUT_CACHE_DIR / f"warp_lut_{digest}.npz"
+
+def _build_warp_lut(src_width, src_height, geotransform, output_bounds, output_width):
+    """
+    预计算每个输出像素对应的源像素坐标与双线性插值权重。
+    卫星位置、目标范围和输出宽度固定，因此该映射对所有帧完全相同。
+    """
+    from pyproj import Transformer
+
+    min_x, min_y, max_x, max_y = output_bounds
+    res = (max_x - min_x) / output_width
+    out_height = int(round((max_y - min_y) / res))
+
+    xs = min_x + (np.arange(output_width, dtype=np.float64) + 0.5) * res
+    ys = max_y - (np.arange(out_height, dtype=np.float64) + 0.5) * res
+    gx, gy = np.meshgrid(xs, ys)
+
+    transformer = Transformer.from_crs("EPSG:3857", GEOS_PROJ4, always_xy=True)
+    sx, sy = transformer.transform(gx, gy)
+
+    # 地心投影换算为源图像的浮点像素坐标（以像素中心为基准）
+    px = (sx - geotransform[0]) / geotransform[1] - 0.5
+    py = (sy - geotransform[3]) / geotransform[5] - 0.5
+    valid = np.isfinite(px) & np.isfinite(py) & (px >= 0) & (py >= 0) \
+        & (px <= src_width - 1) & (py <= src_height - 1)
+    px = np.where(valid, px, 0.0)
+    py = np.where(valid, py, 0.0)
+
+    x0 = np.floor(px).astype(np.int32)
+    y0 = np.floor(py).astype(np.int32)
+    fx = (px - x0).astype(np.float32)
+    fy = (py - y0).astype(np.float32)
+    np.minimum(x0, src_width - 2, out=x0)
+    np.minimum(y0, src_height - 2, out=y0)
+
+    return {'x0': x0, 'y0': y0, 'fx': fx, 'fy': fy, 'valid': valid}
+
+def _apply_warp_lut(src_ds, lut, output_bounds, output_width, output_geotiff_path):
+    """用缓存的查找表做双线性重采样，并写出带Alpha的Web墨卡托GeoTIFF。"""
+    data = src_ds.ReadAsArray()
+    if data.ndim == 2:
+        data = data[np.newaxis, :, :]
+    data = data[:3]
+
+    x0, y0 = lut['x0'], lut['y0']
+    fx, fy = lut['fx'], lut['fy']
+    valid = lut['valid']
+    out_height, out_w = x0.shape
+
+    w00 = (1 - fx) * (1 - fy)
+    w01 = fx * (1 - fy)
+    w10 = (1 - fx) * fy
+    w11 = fx * fy
+
+    src_width = src_ds.RasterXSize
+    idx00 = (y0.astype(np.int64) * src_width + x0).ravel()
+    idx01 = idx00 + 1
+    idx10 = idx00 + src_width
+    idx11 = idx10 + 1
+
+    out_bands = []
+    for band in data:
+        flat = band.ravel()
+        resampled = (
+            flat[idx00] * w00.ravel() + flat[idx01] * w01.ravel()
+            + flat[idx10] * w10.ravel() + flat[idx11] * w11.ravel()
+        )
+        out_bands.append(np.clip(np.rint(resampled), 0, 255).astype(np.uint8).reshape(out_height, out_w))
+
+    min_x, min_y, max_x, max_y = output_bounds
+    res = (max_x - min_x) / output_width
+
+    driver = gdal.GetDriverByName('GTiff')
+    out_ds = driver.Create(
+        output_geotiff_path, out_w, out_height, len(out_bands) + 1, gdal.GDT_Byte,
+        options=['COMPRESS=LZW', 'TILED=YES', 'NUM_THREADS=ALL_CPUS', 'PREDICTOR=2']
+    )
+    srs_3857 = osr.SpatialReference()
+    srs_3857.ImportFromEPSG(3857)
+    out_ds.SetProjection(srs_3857.ExportToWkt())
+    out_ds.SetGeoTransform([min_x, res, 0, max_y, 0, -res])
+    out_ds.SetMetadataItem("SATELLITE", "Fengyun-4B (FY-4B)")
+    for i, band in enumerate(out_bands, start=1):
+        out_ds.GetRasterBand(i).WriteArray(band)
+    alpha_band = out_ds.GetRasterBand(len(out_bands) + 1)
+    alpha_band.WriteArray(np.where(valid, 255, 0).astype(np.uint8))
+    alpha_band.SetColorInterpretation(gdal.GCI_AlphaBand)
+    out_ds = None
+
+def _quantize_geotiff(geotiff_path):
+    """
+    把RGBA GeoTIFF就地量化为256色单波段调色板TIFF（GEOTIFF_QUANTIZE=1时启用）。
+    磁盘体积与下游读取流量约降为1/4；索引0保留给全透明像素。
+    """
+    from PIL import Image
+
+    src = gdal.Open(geotiff_path, gdal.GA_ReadOnly)
+    data = src.ReadAsArray()
+    if data.ndim != 3 or data.shape[0] < 3:
+        print("Warning: Quantization skipped, output is not an RGB(A) raster.")
+        return
+
+    rgb = np.ascontiguousarray(np.transpose(data[:3], (1, 2, 0)))
+    alpha = data[3] if data.shape[0] >= 4 else None
+
+    quantized = Image.fromarray(rgb).quantize(255, method=Image.MEDIANCUT)
+    indices = np.asarray(quantized, dtype=np.uint8) + 1
+    if alpha is not None:
+        indices[alpha == 0] = 0
+    palette = quantized.getpalette()
+
+    color_table = gdal.ColorTable()
+    color_table.SetColorEntry(0, (0, 0, 0, 0))
+    for i in range(255):
+        r, g, b = palette[i * 3:i * 3 + 3]
+        color_table.SetColorEntry(i + 1, (r, g, b, 255))
+
+    tmp_path = geotiff_path + '.quant.tif'
+    driver = gdal.GetDriverByName('GTiff')
+    out_ds = driver.Create(
+        tmp_path, src.RasterXSize, src.RasterYSize, 1, gdal.GDT_Byte,
+        options=['COMPRESS=LZW', 'TILED=YES']
+    )
+    out_ds.SetProjection(src.GetProjection())
+    out_ds.SetGeoTransform(src.GetGeoTransform())
+    out_ds.SetMetadata(src.GetMetadata())
+    band = out_ds.GetRasterBand(1)
+    band.SetRasterColorTable(color_table)
+    band.SetRasterColorInterpretation(gdal.GCI_PaletteIndex)
+    band.WriteArray(indices)
+    out_ds = None
+    src = None
+    os.replace(tmp_path, geotiff_path)
+    print("--- Quantized output to 256-color paletted single band ---")
+
 def create_geotiff_from_image(input_image_path, output_geotiff_path, bbox_config, output_width):
     """
     为PNG图像添加地理参考，并将其裁剪重投影为Web墨卡托GeoTIFF。
@@ -38,30 +186,56 @@ def create_geotiff_from_image(input_image_path, output_geotiff_path, bbox_config
     print(f"Image dimensions: {width}x{height}")
 
     srs_source = osr.SpatialReference()
-    proj4_string = "+proj=geos +h=35785831 +lon_0=104.9 +sweep=x +datum=WGS84 +units=m"
-    srs_source.ImportFromProj4(proj4_string)
-    
+    srs_source.ImportFromProj4(GEOS_PROJ4)
+
     x_min, x_max, y_min, y_max = -5568748.0, 5568748.0, -5568748.0, 5568748.0
     geotransform = [x_min, (x_max - x_min) / width, 0, y_max, 0, (y_min - y_max) / height]
 
-    vrt_path = "temp_georeferenced.vrt"
+    output_bounds_mercator = transform_bbox_4326_to_3857(bbox_config)
+
+    # 网格映射固定（卫星位置、目标范围、输出宽度不变），可用预计算查找表代替逐帧Warp
+    if os.getenv('GEOTIFF_USE_WARP_LUT'):
+        try:
+            lut_path = _warp_lut_path(width, height, tuple(output_bounds_mercator), output_width)
+            if lut_path.exists():
+                lut = dict(np.load(lut_path))
+                print(f"--- Step 2: Loaded cached warp lookup table: {lut_path} ---")
+            else:
+                print("--- Step 2: Building warp lookup table (first run for this grid) ---")
+                lut = _build_warp_lut(width, height, geotransform, output_bounds_mercator, output_width)
+                WARP_LUT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                np.savez_compressed(lut_path, **lut)
+            print(f"--- Step 3: Resampling via lookup table -> {output_geotiff_path} ---")
+            _apply_warp_lut(src_ds, lut, output_bounds_mercator, output_width, output_geotiff_path)
+            src_ds = None
+            print("--- Reprojection successful! ---")
+            if os.getenv('GEOTIFF_QUANTIZE'):
+                _quantize_geotiff(output_geotiff_path)
+            return True
+        except Exception as e:
+            print(f"Warning: Lookup-table warp failed ({e}). Falling back to gdal.Warp.")
+
+    # 在内存中构建VRT，避免磁盘往返和XML解析
     driver = gdal.GetDriverByName('VRT')
-    vrt_ds = driver.CreateCopy(vrt_path, src_ds)
+    vrt_ds = driver.CreateCopy('', src_ds)
     vrt_ds.SetProjection(srs_source.ExportToWkt())
     vrt_ds.SetGeoTransform(geotransform)
     vrt_ds.SetMetadataItem("SATELLITE", "Fengyun-4B (FY-4B)")
-    vrt_ds = None
-    src_ds = None
-    print(f"--- Step 2: Created virtual georeferenced file at '{vrt_path}' ---")
+    print("--- Step 2: Created in-memory georeferenced dataset ---")
+
+    # 放大GDAL块缓存并启用多线程重采样，充分利用多核
+    gdal.SetConfigOption('GDAL_CACHEMAX', os.getenv('GDAL_CACHEMAX', '2048'))
+    gdal.SetConfigOption('GDAL_NUM_THREADS', 'ALL_CPUS')
 
-    output_bounds_mercator = transform_bbox_4326_to_3857(bbox_config)
-    
     warp_options = gdal.WarpOptions(
         dstSRS='EPSG:3857',
         format='GTiff',
         resampleAlg=gdal.GRA_Bilinear,
         dstAlpha=True,
-        creationOptions=['COMPRESS=LZW', 'TILED=YES'],
+        multithread=True,
+        warpOptions=['NUM_THREADS=ALL_CPUS'],
+        warpMemoryLimit=1 << 30,
+        creationOptions=['COMPRESS=LZW', 'TILED=YES', 'NUM_THREADS=ALL_CPUS', 'PREDICTOR=2'],
         outputBounds=output_bounds_mercator,
         width=output_width
     )
@@ -72,31 +246,24 @@ def create_geotiff_from_image(input_image_path, output_geotiff_path, bbox_config
     
     success = False
     try:
-        gdal.Warp(output_geotiff_path, vrt_path, options=warp_options)
+        gdal.Warp(output_geotiff_path, vrt_ds, options=warp_options)
         print("--- Reprojection successful! ---")
+        if os.getenv('GEOTIFF_QUANTIZE'):
+            _quantize_geotiff(output_geotiff_path)
         success = True
     except Exception as e:
         print(f"An error occurred during reprojection: {e}")
     finally:
-        if os.path.exists(vrt_path):
-            os.remove(vrt_path)
-            print(f"--- Step 4: Cleaned up temporary file '{vrt_path}' ---")
-    
-    return success
+        vrt_ds = None
+        src_ds = None
 
-if __name__ == "__main__":
-    # 在程序开始时加载 .env 文件
-    load_dotenv()
-    
-    parser = argparse.ArgumentParser(
-        description="Creates a cropped GeoTIFF from a PNG based on a timestamp, then cleans up the source."
-    )
-    parser.add_argument("timestamp", type=str, help="The timestamp of the image to process, in 'YYYYMMDDHHMMSS' format.")
-    parser.add_argument("-d", "--data-dir", type=str, default='./data', help="The base directory for input and output files.")
-    parser.add_argument("--keep-source", action="store_true", help="If specified, do not delete the source file.")
-    args = parser.parse_args()
+    return success
 
-    # --- 从环境变量读取配置，并提供默认值 ---
+def run(timestamp, data_dir, keep_source=False):
+    """
+    生成单个时间戳GeoTIFF的完整入口，供main_workflow进程内调用。
+    裁剪范围与输出宽度仍从环境变量读取。返回True/False。
+    """
     bbox_config = {
         "north": float(os.getenv('GEOTIFF_BBOX_NORTH', 55.0)),
         "south": float(os.getenv('GEOTIFF_BBOX_SOUTH', -55.0)),
@@ -105,23 +272,18 @@ if __name__ == "__main__":
     }
     output_width = int(os.getenv('GEOTIFF_OUTPUT_WIDTH', 4096))
 
-    # --- 自动构建文件路径 ---
-    input_filename = f"fy4b_full_disk_{args.timestamp}_adjusted.png"
-    input_filepath = os.path.join(args.data_dir, input_filename)
-    output_filename = f"fy4b_full_disk_{args.timestamp}_adjusted_mercator.tif"
-    output_filepath = os.path.join(args.data_dir, output_filename)
+    input_filepath = os.path.join(data_dir, f"fy4b_full_disk_{timestamp}_adjusted.png")
+    output_filepath = os.path.join(data_dir, f"fy4b_full_disk_{timestamp}_adjusted_mercator.tif")
 
     if not os.path.exists(input_filepath):
         print(f"Error: Input file not found at '{input_filepath}'.")
-        sys.exit(1)
-        
-    # --- 调用核心函数，传入配置 ---
+        return False
+
     success = create_geotiff_from_image(input_filepath, output_filepath, bbox_config, output_width)
-    
-    # --- 成功后自动删除源文件 ---
+
     if success:
         print(f"\n✅ GeoTIFF creation successful.")
-        if not args.keep_source:
+        if not keep_source:
             try:
                 os.remove(input_filepath)
                 print(f"Successfully deleted source file: {input_filepath}")
@@ -130,4 +292,20 @@ if __name__ == "__main__":
         else:
             print(f"Source file '{input_filepath}' has been kept as requested.")
     else:
-        print(f"\n❌ GeoTIFF creation failed. Source file '{input_filepath}' has been kept for inspection.")
\ No newline at end of file
+        print(f"\n❌ GeoTIFF creation failed. Source file '{input_filepath}' has been kept for inspection.")
+    return success
+
+if __name__ == "__main__":
+    # 在程序开始时加载 .env 文件
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(
+        description="Creates a cropped GeoTIFF from a PNG based on a timestamp, then cleans up the source."
+    )
+    parser.add_argument("timestamp", type=str, help="The timestamp of the image to process, in 'YYYYMMDDHHMMSS' format.")
+    parser.add_argument("-d", "--data-dir", type=str, default='./data', help="The base directory for input and output files.")
+    parser.add_argument("--keep-source", action="store_true", help="If specified, do not delete the source file.")
+    args = parser.parse_args()
+
+    if not run(args.timestamp, args.data_dir, keep_source=args.keep_source):
+        sys.exit(1)
\ No newline at end of file
@@ -1,84 +1,192 @@
 import os
 import argparse
+import functools
 import subprocess
 import shutil
 import sys
 import json
+import threading
+import multiprocessing
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 
-def process_and_tile_by_timestamp(timestamp_str, data_dir, zoom_range='1-7', gdal2tiles_path_arg=None):
+_CPU_CORES = os.cpu_count() or 1
+
+# 批量模式下多个工作线程会同时更新 timestamps.json / tile_manifest.json
+_CATALOG_LOCK = threading.Lock()
+
+# 优先在本进程内直接调用gdal2tiles，免去每个时间戳一次的解释器/GDAL冷启动
+try:
+    from osgeo_utils import gdal2tiles as gdal2tiles_module
+except ImportError:
+    gdal2tiles_module = None
+
+@functools.lru_cache(maxsize=1)
+def _resolve_gdal2tiles(explicit_path):
+    """
+    解析gdal2tiles.py脚本路径：命令行参数 > 环境变量 > 系统PATH。
+    结果按参数缓存，批量处理多个时间戳时只做一次PATH扫描。
+    找不到时返回None。
+    """
+    if explicit_path:
+        if os.path.isfile(explicit_path):
+            return explicit_path
+        print(f"\nError: Path provided via --gdal2tiles-path is not a valid file: {explicit_path}")
+        sys.exit(1)
+    env_path = os.getenv('GDAL2TILES_PATH')
+    if env_path:
+        if os.path.isfile(env_path):
+            return env_path
+        print(f"\nWarning: Path in GDAL2TILES_PATH is not a valid file: {env_path}. Falling back to system PATH.")
+    return shutil.which('gdal2tiles.py')
+
+def _gdal_tuned_env():
+    """
+    为GDAL子进程准备环境变量：块缓存从默认40MB提到2GB（z1-7各层会反复
+    命中同一批源块），读写走ALL_CPUS多线程，VSI缓存开到1GB，并跳过
+    sidecar文件（.aux.xml/.msk等）的目录探测。已有同名变量时不覆盖。
+    """
+    env = os.environ.copy()
+    env.setdefault("GDAL_CACHEMAX", "2048")
+    env.setdefault("GDAL_NUM_THREADS", "ALL_CPUS")
+    env.setdefault("VSI_CACHE", "TRUE")
+    env.setdefault("VSI_CACHE_SIZE", "1073741824")
+    env.setdefault("GDAL_DISABLE_READDIR_ON_OPEN", "EMPTY_DIR")
+    return env
+
+def _record_tile_manifest(manifest_path, unix_timestamp, manifest_key):
+    """
+    切片成功后记录时间戳与源文件指纹。只在成功路径调用：失败的任务
+    不应在目录里留下半成品条目，否则跳过缓存会误判其已完成。
+    """
+    with _CATALOG_LOCK:
+        with open(os.path.join(os.path.dirname(manifest_path), 'timestamps.log'), 'a') as f:
+            f.write(f"{unix_timestamp}\n")
+        manifest = {}
+        try:
+            if os.path.exists(manifest_path):
+                with open(manifest_path, 'r') as f: manifest = json.load(f)
+        except (json.JSONDecodeError, OSError): manifest = {}
+        manifest[str(unix_timestamp)] = manifest_key
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f: json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+def rebuild_timestamps_json(base_output_dir):
+    """
+    从追加式的timestamps.log物化出排序去重后的timestamps.json。
+    切片时只做O(1)的日志追加，每次调用（批量时每批一次）在这里付一次
+    O(N)的重建成本，替代原来每个时间戳整表重写的O(N²)写放大。
+    兼容旧档案：已有的timestamps.json内容会并入结果。
+    """
+    json_path = os.path.join(base_output_dir, 'timestamps.json')
+    log_path = os.path.join(base_output_dir, 'timestamps.log')
+    with _CATALOG_LOCK:
+        timestamps = set()
+        try:
+            if os.path.exists(json_path):
+                with open(json_path, 'r') as f: timestamps.update(json.load(f))
+        except (json.JSONDecodeError, OSError): pass
+        try:
+            if os.path.exists(log_path):
+                with open(log_path, 'r') as f:
+                    timestamps.update(int(line) for line in f if line.strip())
+        except (ValueError, OSError): pass
+        tmp_path = json_path + '.tmp'
+        with open(tmp_path, 'w') as f: json.dump(sorted(timestamps), f, indent=2)
+        os.replace(tmp_path, json_path)
+    print(f"Rebuilt 'timestamps.json' with {len(timestamps)} timestamps.")
+
+def process_and_tile_by_timestamp(timestamp_str, data_dir, zoom_range='1-7', gdal2tiles_path_arg=None, force=False, processes=None, output_format='tiles', tile_format='webp'):
     """
     根据时间戳自动查找GeoTIFF，切片为XYZ标准的瓦片，并更新timestamps.json。
+    output_format='cog' 时改为生成单个Cloud-Optimized GeoTIFF（配合动态瓦片服务使用），
+    把上万个小PNG的打开/写入/fsync合并为一条顺序写入流。
     """
-    # --- 路径和文件名推断 ---
+    # --- 先做完所有廉价校验，再碰文件系统：失败的任务不留下孤儿目录 ---
     print(f"--- Processing timestamp: {timestamp_str} ---")
     input_filename = f"fy4b_full_disk_{timestamp_str}_adjusted_mercator.tif"
     input_geotiff = os.path.join(data_dir, input_filename)
     if not os.path.exists(input_geotiff):
         print(f"\nError: Input GeoTIFF file not found at '{input_geotiff}'")
         sys.exit(1)
-        
-    # --- 时间戳转换与输出目录设置 ---
+
     try:
         dt_object = datetime.strptime(timestamp_str, '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
         unix_timestamp = int(dt_object.timestamp())
     except ValueError:
         print(f"Error: Invalid timestamp format '{timestamp_str}'. Please use YYYYMMDDHHMMSS.")
         sys.exit(1)
+
+    # 没有进程内gdal2tiles时提前解析脚本路径，缺工具就在创建输出目录前失败
+    gdal2tiles_path = None
+    if output_format != 'cog' and gdal2tiles_module is None:
+        gdal2tiles_path = _resolve_gdal2tiles(gdal2tiles_path_arg)
+        if not gdal2tiles_path:
+            print("\nError: Could not locate 'gdal2tiles.py'.")
+            sys.exit(1)
+
+    # --- 输出目录设置 ---
     base_output_dir = os.path.join(data_dir, 'satellite_tiles')
     os.makedirs(base_output_dir, exist_ok=True)
     tile_output_dir = os.path.join(base_output_dir, str(unix_timestamp))
-    # 如果目录已存在，先清空，确保是全新的切片
-    if os.path.exists(tile_output_dir):
+    # 默认增量切片（--resume跳过已有瓦片）；--force时先清空，强制全量重建
+    if force and os.path.exists(tile_output_dir):
+        print("Force mode: removing existing tiles for a full rebuild.")
         shutil.rmtree(tile_output_dir)
     os.makedirs(tile_output_dir, exist_ok=True)
     print(f"Input GeoTIFF: {input_geotiff}")
     print(f"Output Tile Directory: {tile_output_dir}")
 
-    # --- 更新 timestamps.json ---
-    json_path = os.path.join(base_output_dir, 'timestamps.json')
-    timestamps = []
+    # --- 源文件指纹：输入和参数没变时跳过整个切片过程 ---
+    # 时间戳在成功后才随指纹一起追加到timestamps.log（见_record_tile_manifest）
+    manifest_path = os.path.join(base_output_dir, 'tile_manifest.json')
+    stat = os.stat(input_geotiff)
+    manifest_key = [stat.st_size, stat.st_mtime_ns, zoom_range, output_format, tile_format]
+    manifest = {}
     try:
-        if os.path.exists(json_path):
-            with open(json_path, 'r') as f: timestamps = json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError): timestamps = []
-    if unix_timestamp not in timestamps:
-        timestamps.append(unix_timestamp)
-        timestamps.sort()
-        with open(json_path, 'w') as f: json.dump(timestamps, f, indent=2)
-        print(f"Added timestamp {unix_timestamp} to 'timestamps.json'.")
-    else:
-        print(f"Timestamp {unix_timestamp} already exists in 'timestamps.json'.")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f: manifest = json.load(f)
+    except (json.JSONDecodeError, OSError): manifest = {}
+    if not force and manifest.get(str(unix_timestamp)) == manifest_key:
+        print("\nTiles are up-to-date for this source GeoTIFF; skipping (use --force to rebuild).")
+        return
 
-    # --- gdal2tiles.py 路径查找逻辑 ---
-    print("\n--- Locating gdal2tiles.py ---")
-    gdal2tiles_path = None
-    if gdal2tiles_path_arg:
-        if os.path.isfile(gdal2tiles_path_arg): gdal2tiles_path = gdal2tiles_path_arg
-        else:
-            print(f"\nError: Path provided via --gdal2tiles-path is not a valid file: {gdal2tiles_path_arg}")
-            sys.exit(1)
-    if not gdal2tiles_path:
-        env_path = os.getenv('GDAL2TILES_PATH')
-        if env_path:
-            if os.path.isfile(env_path): gdal2tiles_path = env_path
-            else: print(f"\nWarning: Path in GDAL2TILES_PATH is not a valid file: {env_path}. Falling back to system PATH.")
-    if not gdal2tiles_path:
-        gdal2tiles_path = shutil.which('gdal2tiles.py')
-    if not gdal2tiles_path:
-        print("\nError: Could not locate 'gdal2tiles.py'.")
-        sys.exit(1)
-    print(f"Successfully located gdal2tiles.py at: {gdal2tiles_path}")
-        
-    # --- 执行 gdal2tiles.py ---
-    try: cpu_cores = os.cpu_count()
-    except NotImplementedError: cpu_cores = 1
-    
-    command = [
-        sys.executable, gdal2tiles_path,
+    cpu_cores = processes or _CPU_CORES
+
+    # --- COG 输出模式 ---
+    if output_format == 'cog':
+        cog_path = os.path.join(tile_output_dir, 'fy4b.cog.tif')
+        command = [
+            'gdal_translate', input_geotiff, cog_path,
+            '-of', 'COG',
+            '-co', 'TILING_SCHEME=GoogleMapsCompatible',
+            '-co', 'COMPRESS=WEBP',
+            '-co', 'QUALITY=85',
+            '-co', f'NUM_THREADS={cpu_cores}',
+            '-co', 'OVERVIEWS=IGNORE_EXISTING'
+        ]
+        print("\n--- Starting COG generation ---")
+        print(f"Executing command:\n{' '.join(command)}\n")
+        try:
+            result = subprocess.run(command, env=_gdal_tuned_env())
+            if result.returncode == 0:
+                print("\n--- COG generation completed successfully! ---")
+                _record_tile_manifest(manifest_path, unix_timestamp, manifest_key)
+            else:
+                print(f"\nError: gdal_translate exited with error code {result.returncode}.")
+        except Exception as e:
+            print(f"An unexpected error occurred: {e}")
+        return
+
+    # --- 组装 gdal2tiles 参数 ---
+
+    gdal2tiles_args = [
         '--profile', 'mercator',
+        '--resume',  # 跳过已生成的瓦片，部分完成的任务可以增量续跑
         '--xyz',  # <--- 此标志以使用 XYZ 瓦片标准
+        # WEBP编码比PNG的DEFLATE省CPU，体积也小2-4倍（需GDAL>=3.6）
+        '--tiledriver', tile_format.upper(),
         '--zoom', zoom_range,
         '--processes', str(cpu_cores),
         '--webviewer', 'leaflet',
@@ -86,27 +194,121 @@ def process_and_tile_by_timestamp(timestamp_str, data_dir, zoom_range='1-7', gda
         input_geotiff,
         tile_output_dir
     ]
-    
+
+    # --- 优先在本进程内调用 ---
+    if gdal2tiles_module is not None:
+        print("\n--- Starting the tiling process in-process (XYZ standard) ---")
+        print(f"gdal2tiles arguments:\n{' '.join(gdal2tiles_args)}\n")
+        try:
+            return_code = gdal2tiles_module.main(['gdal2tiles.py'] + gdal2tiles_args)
+        except SystemExit as e:
+            return_code = e.code or 0
+        except Exception as e:
+            print(f"An unexpected error occurred: {e}")
+            return
+        if not return_code:
+            print("\n--- Tiling process completed successfully! ---")
+            _record_tile_manifest(manifest_path, unix_timestamp, manifest_key)
+        else: print(f"\nError: gdal2tiles exited with error code {return_code}.")
+        return
+
+    # --- 回退：执行开头已定位到的 gdal2tiles.py ---
+    print(f"\nUsing gdal2tiles.py at: {gdal2tiles_path}")
+    command = [sys.executable, gdal2tiles_path] + gdal2tiles_args
+
     print("\n--- Starting the tiling process (XYZ standard) ---")
     print(f"Executing command:\n{' '.join(command)}\n")
     try:
-        my_env = os.environ.copy()
+        my_env = _gdal_tuned_env()
         my_env["PYTHONWARNINGS"] = "ignore:FutureWarning"
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1, env=my_env)
-        for line in iter(process.stdout.readline, ''): print(line, end='')
+        # 让子进程直接继承终端fd：内核直写控制台，省去Python逐行搬运，
+        # gdal2tiles的回车进度条也能正常渲染
+        process = subprocess.Popen(command, stdout=None, stderr=subprocess.STDOUT, env=my_env)
         process.wait()
-        if process.returncode == 0: print("\n--- Tiling process completed successfully! ---")
+        if process.returncode == 0:
+            print("\n--- Tiling process completed successfully! ---")
+            _record_tile_manifest(manifest_path, unix_timestamp, manifest_key)
         else: print(f"\nError: gdal2tiles.py exited with error code {process.returncode}.")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
+def _init_pool_worker(catalog_lock):
+    """
+    批处理工作进程初始化：模块导入时osgeo_utils.gdal2tiles已随之加载，
+    GDAL/proj初始化每个工作进程只付一次，之后在池内跨任务复用；
+    目录文件锁替换为跨进程的multiprocessing.Lock。
+    """
+    global _CATALOG_LOCK
+    _CATALOG_LOCK = catalog_lock
+
+def _tile_one(job):
+    """池任务入口：切片单个时间戳，返回 (timestamp, 是否成功)。"""
+    ts, data_dir, zoom_range, gdal2tiles_path_arg, force, processes, tile_format = job
+    try:
+        process_and_tile_by_timestamp(
+            ts, data_dir,
+            zoom_range=zoom_range,
+            gdal2tiles_path_arg=gdal2tiles_path_arg,
+            force=force,
+            processes=processes,
+            tile_format=tile_format
+        )
+        return ts, True
+    except SystemExit:
+        return ts, False
+    except Exception as e:
+        print(f"[{ts}] Unexpected error: {e}")
+        return ts, False
+
+def process_batch(timestamps, data_dir, zoom_range='1-7', gdal2tiles_path_arg=None, force=False, concurrency=2, tile_format='webp'):
+    """
+    并发切片多个时间戳：常驻进程池让每个工作进程的解释器+GDAL冷启动
+    只发生一次，由池内所有任务分摊；外层2-3路并发即可让一个任务编码
+    瓦片时另一个读取/重采样。Pool的工作进程是daemonic的，不允许再
+    派生子进程，所以每个任务内gdal2tiles固定单进程运行，并行度全部
+    由外层进程池提供（要吃满核数就调大--concurrency）。
+    """
+    print(f"--- Tiling {len(timestamps)} timestamps, concurrency={concurrency}, 1 gdal2tiles process each ---")
+
+    jobs = [(ts, data_dir, zoom_range, gdal2tiles_path_arg, force, 1, tile_format) for ts in timestamps]
+    catalog_lock = multiprocessing.Lock()
+    failed = []
+    with multiprocessing.Pool(processes=concurrency, initializer=_init_pool_worker, initargs=(catalog_lock,)) as pool:
+        for ts, success in pool.imap_unordered(_tile_one, jobs):
+            if not success:
+                failed.append(ts)
+
+    rebuild_timestamps_json(os.path.join(data_dir, 'satellite_tiles'))
+
+    if failed:
+        print(f"\n❌ {len(failed)} timestamp(s) failed: {', '.join(sorted(failed))}")
+    else:
+        print("\n✅ All timestamps tiled successfully.")
+    return not failed
+
+def run(timestamp, data_dir):
+    """
+    切片单个时间戳的完整入口，供main_workflow进程内调用（GDAL/proj
+    初始化在守护进程内只付一次）。process_and_tile_by_timestamp里的
+    sys.exit在这里转换为返回False。返回True/False。
+    """
+    zoom_range = os.getenv('TILES_ZOOM_RANGE', '1-7')
+    try:
+        process_and_tile_by_timestamp(timestamp, data_dir, zoom_range=zoom_range)
+    except SystemExit:
+        return False
+    rebuild_timestamps_json(os.path.join(data_dir, 'satellite_tiles'))
+    return True
+
 if __name__ == "__main__":
     load_dotenv()
-    
+
     parser = argparse.ArgumentParser(
         description="Creates map tiles from a georeferenced TIFF file based on a timestamp."
     )
-    parser.add_argument("timestamp", type=str, help="The timestamp of the data to process, in 'YYYYMMDDHHMMSS' format.")
+    parser.add_argument("timestamp", type=str, nargs='?', help="The timestamp of the data to process, in 'YYYYMMDDHHMMSS' format.")
+    parser.add_argument("--batch", type=str, help="Path to a text file with one timestamp per line; tiles them concurrently.")
+    parser.add_argument("--concurrency", type=int, default=2, help="Number of timestamps to tile in parallel in batch mode. Default: 2.")
     parser.add_argument("-d", "--data-dir", type=str, default="data", help="The base directory for input TIFFs and output tiles. Default: 'data'")
     
     parser.add_argument(
@@ -114,16 +316,54 @@ if __name__ == "__main__":
         type=str,
         help="Explicit path to gdal2tiles.py. Overrides environment variables and system PATH."
     )
-    
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Delete any existing tiles for this timestamp and rebuild from scratch."
+    )
+    parser.add_argument(
+        "--format",
+        choices=['tiles', 'cog'],
+        default='tiles',
+        help="Output format: 'tiles' for an XYZ tile tree (default), 'cog' for a single Cloud-Optimized GeoTIFF."
+    )
+    parser.add_argument(
+        "--tile-format",
+        choices=['png', 'webp', 'jpeg'],
+        default='webp',
+        help="Tile image encoding for gdal2tiles (requires GDAL >= 3.6 for webp). Default: 'webp'."
+    )
+
     args = parser.parse_args()
 
     zoom_range = os.getenv('TILES_ZOOM_RANGE', '1-7')
-    
-    process_and_tile_by_timestamp(
-        args.timestamp, 
-        args.data_dir, 
-        zoom_range=zoom_range, 
-        gdal2tiles_path_arg=args.gdal2tiles_path
-    )
-    
+
+    if args.batch:
+        with open(args.batch, 'r') as f:
+            batch_timestamps = [line.strip() for line in f if line.strip()]
+        if not batch_timestamps:
+            parser.error(f"Batch file '{args.batch}' contains no timestamps.")
+        process_batch(
+            batch_timestamps,
+            args.data_dir,
+            zoom_range=zoom_range,
+            gdal2tiles_path_arg=args.gdal2tiles_path,
+            force=args.force,
+            concurrency=args.concurrency,
+            tile_format=args.tile_format
+        )
+    elif args.timestamp:
+        process_and_tile_by_timestamp(
+            args.timestamp,
+            args.data_dir,
+            zoom_range=zoom_range,
+            gdal2tiles_path_arg=args.gdal2tiles_path,
+            force=args.force,
+            output_format=args.format,
+            tile_format=args.tile_format
+        )
+        rebuild_timestamps_json(os.path.join(args.data_dir, 'satellite_tiles'))
+    else:
+        parser.error("Provide a timestamp or --batch file.")
+
     print(f"\n✅ All done! Check the output in '{os.path.join(args.data_dir, 'satellite_tiles')}' directory.")
\ No newline at end of file
@@ -6,6 +6,103 @@ import numpy as np
 # 禁用Pillow的像素限制，以处理大图
 Image.MAX_IMAGE_PIXELS = None
 
+def _content_masks(strip, threshold):
+    """
+    求条带的行/列内容掩码。阈值比较得到的字节掩码按uint64重解释，
+    8个像素合成一个通道：行归约变成每8列一次qword any，列归约变成
+    一次按位OR后再展回字节，避免在H×W的bool数组上逐字节扫两遍。
+    """
+    h, w = strip.shape
+    wp = (w + 7) & ~7
+    if wp != w:
+        padded = np.zeros((h, wp), dtype=strip.dtype)
+        padded[:, :w] = strip
+        strip = padded
+    lanes = (strip > threshold).view(np.uint64).reshape(h, wp // 8)
+    row_mask = lanes.any(axis=1)
+    col_mask = np.bitwise_or.reduce(lanes, axis=0).view(np.uint8)[:w] != 0
+    return row_mask, col_mask
+
+def _adjust_geotiff_via_overview(input_image_path, output_image_path, threshold, crop_x, crop_y):
+    """
+    GeoTIFF快速路径：在最粗的内建金字塔层上找包围盒（像素数只有全分辨率的
+    几千分之一），换算回全分辨率坐标后用gdal.Translate的srcWin一次完成
+    裁剪/填充，全程不解码整幅图。没有金字塔或任何失败时返回False，
+    由调用方回退Pillow路径。
+    """
+    from osgeo import gdal
+
+    ds = gdal.Open(input_image_path, gdal.GA_ReadOnly)
+    if ds is None:
+        return False
+    band = ds.GetRasterBand(1)
+    if band.GetOverviewCount() == 0:
+        return False
+    overview = band.GetOverview(band.GetOverviewCount() - 1)
+    arr = overview.ReadAsArray()
+
+    row_mask = (arr > threshold).any(axis=1)
+    col_mask = (arr > threshold).any(axis=0)
+    if not row_mask.any():
+        return False
+
+    scale_x = ds.RasterXSize / overview.XSize
+    scale_y = ds.RasterYSize / overview.YSize
+    # 向外各放宽一个低分辨率像素，避免粗网格把内容边缘截掉
+    top = max(0, int((np.argmax(row_mask) - 1) * scale_y))
+    bottom = min(ds.RasterYSize, int((len(row_mask) - np.argmax(row_mask[::-1]) + 1) * scale_y))
+    left = max(0, int((np.argmax(col_mask) - 1) * scale_x))
+    right = min(ds.RasterXSize, int((len(col_mask) - np.argmax(col_mask[::-1]) + 1) * scale_x))
+    print(f"Detected content image size (via overview): {(right - left, bottom - top)}")
+
+    # 正值向内收缩，负值向外扩展srcWin（越界部分由GDAL补零）
+    left, right = left + crop_x, right - crop_x
+    top, bottom = top + crop_y, bottom - crop_y
+    if right - left <= 0 or bottom - top <= 0:
+        print("Error: crop values are too large for the detected content size.")
+        return False
+
+    gdal.Translate(output_image_path, ds, srcWin=[left, top, right - left, bottom - top])
+    print(f"Final adjusted size: {(right - left, bottom - top)}")
+    return True
+
+def _adjust_via_vips(input_image_path, output_image_path, threshold, crop_x, crop_y):
+    """
+    libvips路径：find_trim一次调用拿到内容包围盒，随后以sequential模式
+    单遍流式裁剪/填充并写出。解码、扫描、编码都在C层多线程完成，
+    峰值内存只有若干扫描线，千兆像素输入也无需整图驻留。
+    """
+    import pyvips
+
+    probe = pyvips.Image.new_from_file(input_image_path)
+    left, top, w, h = probe.find_trim(threshold=threshold, background=[0, 0, 0])
+    if w == 0 or h == 0:
+        print("Warning: Image appears to be completely empty.")
+        pyvips.Image.new_from_file(input_image_path, access='sequential').write_to_file(output_image_path)
+        return True
+    print(f"Detected content image size: {(w, h)}")
+
+    if crop_x > 0:
+        if 2 * crop_x >= w:
+            print(f"Error: crop_x value ({crop_x}) is too large for image width ({w}).")
+            return False
+        left, w = left + crop_x, w - 2 * crop_x
+    if crop_y > 0:
+        if 2 * crop_y >= h:
+            print(f"Error: crop_y value ({crop_y}) is too large for image height ({h}).")
+            return False
+        top, h = top + crop_y, h - 2 * crop_y
+    pad_x = max(0, -crop_x)
+    pad_y = max(0, -crop_y)
+
+    img = pyvips.Image.new_from_file(input_image_path, access='sequential')
+    out = img.crop(left, top, w, h)
+    if pad_x or pad_y:
+        out = out.embed(pad_x, pad_y, w + 2 * pad_x, h + 2 * pad_y, extend='black')
+    out.write_to_file(output_image_path)
+    print(f"Final adjusted size: {(out.width, out.height)}")
+    return True
+
 def adjust_image_padding(input_image_path, output_image_path, threshold=10, crop_x=0, crop_y=0):
     """
     自动裁剪图像周围的黑色内边距，并根据用户输入进行额外的裁剪（正值）或填充（负值）。
@@ -22,23 +119,58 @@ def adjust_image_padding(input_image_path, output_image_path, threshold=10, crop
         print(f"Error: Input file not found at '{input_image_path}'")
         return
 
+    if input_image_path.lower().endswith(('.tif', '.tiff')):
+        try:
+            if _adjust_geotiff_via_overview(input_image_path, output_image_path, threshold, crop_x, crop_y):
+                print(f"--- Step 2: Saved adjusted image to: {output_image_path} ---")
+                return
+            print("Overview-based crop unavailable for this input; falling back to full decode.")
+        except ImportError:
+            print("GDAL not available; falling back to full decode.")
+        except Exception as e:
+            print(f"Overview-based crop failed ({e}); falling back to full decode.")
+
+    if os.getenv('FY4B_USE_VIPS'):
+        try:
+            if _adjust_via_vips(input_image_path, output_image_path, threshold, crop_x, crop_y):
+                print(f"--- Step 2: Saved adjusted image to: {output_image_path} ---")
+            return
+        except ImportError:
+            print("Warning: FY4B_USE_VIPS is set but pyvips is not installed. Falling back to PIL.")
+        except Exception as e:
+            print(f"pyvips crop failed ({e}); falling back to PIL.")
+
     try:
         im = Image.open(input_image_path)
-        
+
         # 1. 首先，执行自动裁剪，得到一个干净的“核心图像”
-        im_gray = im.convert('L')
-        im_array = np.array(im_gray)
-        non_empty_coords = np.where(im_array > threshold)
-        
-        if non_empty_coords[0].size == 0:
+        # 按水平条带流式扫描：解码内存从O(W·H)降到O(W·条带高)，
+        # JPEG输入用draft让libjpeg直接解码为灰度，解码带宽减半。
+        # draft会就地改写句柄的输出模式，所以扫描用单独的句柄，
+        # im保持未draft状态留给最终的彩色裁剪/保存
+        im_scan = im
+        if im.format == 'JPEG':
+            im_scan = Image.open(input_image_path)
+            im_scan.draft('L', im_scan.size)
+        W, H = im.size
+        strip_height = 1024
+        top = bottom = None
+        left, right = W, -1
+        for y in range(0, H, strip_height):
+            strip = np.asarray(im_scan.crop((0, y, W, min(y + strip_height, H))).convert('L'))
+            row_mask, col_mask = _content_masks(strip, threshold)
+            if row_mask.any():
+                if top is None:
+                    top = y + int(np.argmax(row_mask))
+                bottom = y + int(len(row_mask) - 1 - np.argmax(row_mask[::-1]))
+            if col_mask.any():
+                left = min(left, int(np.argmax(col_mask)))
+                right = max(right, int(len(col_mask) - 1 - np.argmax(col_mask[::-1])))
+
+        if top is None:
             print("Warning: Image appears to be completely empty.")
             im.save(output_image_path)
             return
-            
-        top = int(np.min(non_empty_coords[0]))
-        bottom = int(np.max(non_empty_coords[0]))
-        left = int(np.min(non_empty_coords[1]))
-        right = int(np.max(non_empty_coords[1]))
         
         bbox = (left, top, right + 1, bottom + 1)
         im_core = im.crop(bbox)
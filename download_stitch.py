@@ -1,8 +1,13 @@
+import io
 import os
+import sys
 import shutil
+import threading
 import time
+import asyncio
 import requests
 import argparse
+import numpy as np
 from PIL import Image
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -18,12 +23,49 @@ HEADERS = {
     'Accept-Language': 'zh-CN,zh;q=0.9',
     'Connection': 'keep-alive',
 }
+# aiohttp可选：单事件循环扇出256个请求，免去线程栈与上下文切换开销
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# tifffile可选：分块TIFF可以多线程压缩，编码不再卡在单核zlib上
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
 ZOOM_LEVEL = 4
 GRID_WIDTH = 16
 GRID_HEIGHT = 16
+# 地球圆盘内切于16×16瓦片网格，四角的瓦片必然是纯黑：提前算出圆盘
+# 覆盖到的瓦片集合，角落的24个瓦片连HTTP请求都不用发。半径略放宽
+# 四分之一瓦片作为安全边
+DISK_TILES = frozenset(
+    (x, y)
+    for x in range(GRID_WIDTH) for y in range(GRID_HEIGHT)
+    if (min(max(8.0, x), x + 1) - 8.0) ** 2 + (min(max(8.0, y), y + 1) - 8.0) ** 2 <= 8.25 ** 2
+)
 MIN_IMAGE_SIZE_BYTES = 1024
+# 拼接图是给下一级流水线立刻重新解码的中间产物，zlib级别1已足够；
+# 需要更小的存档文件时可调高
+PNG_COMPRESS_LEVEL = int(os.getenv('FY4B_PNG_COMPRESS_LEVEL', 1))
 Image.MAX_IMAGE_PIXELS = None
 
+def _fetch_tile_bytes(session, timestamp, x, y):
+    """下载单块瓦片，返回响应字节；三次尝试均失败时返回None。"""
+    url = BASE_URL_TEMPLATE.format(timestamp=timestamp, z=ZOOM_LEVEL, x=x, y=y)
+    for attempt in range(3):
+        try:
+            response = session.get(url, timeout=15)
+            content_type = response.headers.get('Content-Type', '').lower()
+            if response.status_code == 200 and ('image/' in content_type or 'octet-stream' in content_type) and len(response.content) > MIN_IMAGE_SIZE_BYTES:
+                return response.content
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(1)
+    return None
+
 def download_single_tile(session, timestamp, temp_dir, x, y):
     filepath = os.path.join(temp_dir, f"tile_{x}_{y}.png")
     if os.path.exists(filepath) and os.path.getsize(filepath) > MIN_IMAGE_SIZE_BYTES:
@@ -31,66 +73,484 @@ def download_single_tile(session, timestamp, temp_dir, x, y):
     url = BASE_URL_TEMPLATE.format(timestamp=timestamp, z=ZOOM_LEVEL, x=x, y=y)
     for attempt in range(3):
         try:
-            response = session.get(url, timeout=15)
-            content_type = response.headers.get('Content-Type', '')
-            content_length = len(response.content)
-            if response.status_code == 200 and 'image' in content_type and content_length > MIN_IMAGE_SIZE_BYTES:
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
-                return f"Downloaded ({x},{y})"
-        except requests.exceptions.RequestException:
+            # stream=True：大小用Content-Length头判断，响应体不在Python层
+            # 整段缓冲，而是边收边写盘，网络接收与磁盘写入重叠
+            with session.get(url, stream=True, timeout=15) as response:
+                content_type = response.headers.get('Content-Type', '').lower()
+                content_length = int(response.headers.get('Content-Length', 0))
+                if response.status_code == 200 and ('image/' in content_type or 'octet-stream' in content_type) and content_length > MIN_IMAGE_SIZE_BYTES:
+                    response.raw.decode_content = True
+                    # 先写.part再原子改名：中途断掉的半个文件不会冒充
+                    # 完整瓦片通过断点续传的大小检查
+                    with open(filepath + '.part', 'wb') as f:
+                        shutil.copyfileobj(response.raw, f, length=65536)
+                    os.replace(filepath + '.part', filepath)
+                    return f"Downloaded ({x},{y})"
+        except (requests.exceptions.RequestException, ValueError, OSError):
             pass
         time.sleep(1)
     create_blank_tile(filepath)
     return f"Failed ({x},{y})"
 
+def _tile_to_rgb_array(img):
+    """瓦片解码为RGB数组；已是RGB模式时跳过convert()的整幅拷贝。"""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return np.asarray(img)
+
+def download_and_stitch_in_memory(session, timestamp, concurrency, tile_size=256):
+    """
+    下载与拼接融合：每个下载线程把响应字节直接解码进共享画布的对应
+    切片（各切片互不重叠，无需加锁），失败的瓦片就地清零。整个过程
+    不落盘，省去256个瓦片文件的写入+回读；代价是没有断点续传，
+    由 FY4B_IN_MEMORY=1 显式启用。
+    返回拼接好的numpy画布，全部瓦片失败时返回None。
+    """
+    print(f"\n开始使用 {concurrency} 个并发线程下载时间戳为 {timestamp} 的卫星瓦片（内存拼接）...")
+    canvas = np.empty((tile_size * GRID_WIDTH, tile_size * GRID_HEIGHT, 3), dtype=np.uint8)
+    valid = np.zeros((GRID_WIDTH, GRID_HEIGHT), dtype=bool)
+
+    # 圆盘外的角落瓦片不参与下载，先把对应切片清零
+    for x in range(GRID_WIDTH):
+        for y in range(GRID_HEIGHT):
+            if (x, y) not in DISK_TILES:
+                canvas[x * tile_size:(x + 1) * tile_size, y * tile_size:(y + 1) * tile_size] = 0
+
+    def _task(x, y):
+        paste_y, paste_x = x * tile_size, y * tile_size
+        data = _fetch_tile_bytes(session, timestamp, x, y)
+        if data is not None:
+            arr = _tile_to_rgb_array(Image.open(io.BytesIO(data)))
+            if arr.shape == (tile_size, tile_size, 3):
+                canvas[paste_y:paste_y + tile_size, paste_x:paste_x + tile_size] = arr
+                valid[x, y] = True
+                return
+            print(f"警告: 瓦片 ({x},{y}) 尺寸异常 {arr.shape[:2]}，该区域将留空。")
+        canvas[paste_y:paste_y + tile_size, paste_x:paste_x + tile_size] = 0
+
+    # x是画布的行方向（paste_y=x*tile_size）：x外层、y内层按内存行序推进，
+    # 相邻任务写入相邻的画布条带，减少缓存/TLB抖动
+    tasks = [(x, y) for x in range(GRID_WIDTH) for y in range(GRID_HEIGHT) if (x, y) in DISK_TILES]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(_task, x, y) for x, y in tasks]
+        with tqdm(total=len(tasks), desc="下载进度") as pbar:
+            for future in as_completed(futures):
+                future.result()
+                pbar.update(1)
+    if not valid.any():
+        print("错误: 所有瓦片都下载失败了。")
+        return None
+    print("\n所有瓦片下载/拼接完成。")
+    return canvas
+
+async def _download_tiles_async(timestamp, temp_dir, concurrency):
+    """
+    aiohttp事件循环版下载：全部瓦片请求在单线程内复用一组keep-alive
+    连接并发推进，用信号量限流。重试与空白瓦片兜底语义与线程版一致。
+    """
+    sem = asyncio.Semaphore(concurrency)
+    tasks = [(x, y) for x in range(GRID_WIDTH) for y in range(GRID_HEIGHT) if (x, y) in DISK_TILES]
+
+    async def fetch(session, x, y):
+        filepath = os.path.join(temp_dir, f"tile_{x}_{y}.png")
+        if os.path.exists(filepath) and os.path.getsize(filepath) > MIN_IMAGE_SIZE_BYTES:
+            return
+        url = BASE_URL_TEMPLATE.format(timestamp=timestamp, z=ZOOM_LEVEL, x=x, y=y)
+        async with sem:
+            for attempt in range(3):
+                try:
+                    async with session.get(url) as response:
+                        content_length = int(response.headers.get('Content-Length', 0))
+                        content_type = response.headers.get('Content-Type', '').lower()
+                        if response.status == 200 and ('image/' in content_type or 'octet-stream' in content_type) \
+                                and content_length > MIN_IMAGE_SIZE_BYTES:
+                            # 分块落盘，响应体不在事件循环里整段积攒；
+                            # .part+原子改名与线程池路径同样语义
+                            with open(filepath + '.part', 'wb') as f:
+                                async for chunk in response.content.iter_chunked(8192):
+                                    f.write(chunk)
+                            os.replace(filepath + '.part', filepath)
+                            return
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                    pass
+                # 指数退避：1s、2s，再失败就交给空白瓦片兜底
+                await asyncio.sleep(2 ** attempt)
+        create_blank_tile(filepath)
+
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=15)
+    async with aiohttp.ClientSession(connector=connector, headers=HEADERS, timeout=timeout) as session:
+        with tqdm(total=len(tasks), desc="下载进度") as pbar:
+            for coro in asyncio.as_completed([fetch(session, x, y) for x, y in tasks]):
+                await coro
+                pbar.update(1)
+
+def download_tile_bytes(session, timestamp, concurrency):
+    """
+    并发抓取全部圆盘瓦片的原始PNG字节，返回 {(x, y): bytes}。
+    下载失败的瓦片不出现在结果里，由拼接端置黑兜底。
+    """
+    print(f"\n开始使用 {concurrency} 个并发线程下载时间戳为 {timestamp} 的卫星瓦片（内存模式）...")
+    tile_bytes = {}
+    tasks = [(x, y) for x in range(GRID_WIDTH) for y in range(GRID_HEIGHT) if (x, y) in DISK_TILES]
+
+    def _task(x, y):
+        data = _fetch_tile_bytes(session, timestamp, x, y)
+        if data is not None:
+            tile_bytes[(x, y)] = data
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(_task, x, y) for x, y in tasks]
+        with tqdm(total=len(tasks), desc="下载进度") as pbar:
+            for future in as_completed(futures):
+                future.result()
+                pbar.update(1)
+    print(f"\n下载完成：{len(tile_bytes)}/{len(tasks)} 块瓦片成功。")
+    return tile_bytes
+
+def stitch_tiles_from_memory(tile_bytes, timestamp, data_dir, output_format='png', keep_tiles_dir=None):
+    """
+    从 {(x, y): PNG字节} 直接解码拼接，省去256个瓦片文件的写入+回读
+    （压缩后的瓦片合计约12MB，常驻内存的代价可忽略）。
+    keep_tiles_dir给定时，后台线程在解码的同时把原始字节落盘留档。
+    """
+    if not tile_bytes:
+        print("错误: 所有瓦片都下载失败了。")
+        return False
+
+    writer = None
+    if keep_tiles_dir:
+        # 留档写盘与解码重叠推进，不占拼接的关键路径
+        def _persist():
+            os.makedirs(keep_tiles_dir, exist_ok=True)
+            for (x, y), data in tile_bytes.items():
+                with open(os.path.join(keep_tiles_dir, f"tile_{x}_{y}.png"), 'wb') as f:
+                    f.write(data)
+        writer = threading.Thread(target=_persist, daemon=True)
+        writer.start()
+
+    try:
+        with Image.open(io.BytesIO(next(iter(tile_bytes.values())))) as sample_tile:
+            tile_width, tile_height = sample_tile.size
+    except Image.UnidentifiedImageError as e:
+        print(f"错误: 无法确定瓦片尺寸。错误: {e}")
+        return False
+
+    full_width = tile_width * GRID_HEIGHT
+    full_height = tile_height * GRID_WIDTH
+    canvas, canvas_raw_path = _alloc_canvas(full_height, full_width)
+    print(f"画布尺寸: {full_width}x{full_height} 像素")
+
+    for x in range(GRID_WIDTH):
+        for y in range(GRID_HEIGHT):
+            if (x, y) not in DISK_TILES:
+                canvas[x * tile_height:(x + 1) * tile_height, y * tile_width:(y + 1) * tile_width] = 0
+
+    def _decode_and_blit(x, y):
+        paste_x = y * tile_width
+        paste_y = x * tile_height
+        data = tile_bytes.get((x, y))
+        if data is not None:
+            try:
+                arr = _tile_to_rgb_array(Image.open(io.BytesIO(data)))
+                if arr.shape == (tile_height, tile_width, 3):
+                    canvas[paste_y:paste_y + tile_height, paste_x:paste_x + tile_width] = arr
+                    return
+            except Image.UnidentifiedImageError:
+                pass
+            print(f"警告: 瓦片 ({x},{y}) 无效，该区域将留空。")
+        canvas[paste_y:paste_y + tile_height, paste_x:paste_x + tile_width] = 0
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+        futures = [executor.submit(_decode_and_blit, x, y)
+                   for x in range(GRID_WIDTH) for y in range(GRID_HEIGHT) if (x, y) in DISK_TILES]
+        for future in as_completed(futures):
+            future.result()
+
+    if canvas_raw_path is not None:
+        canvas.flush()
+    output_filepath = _save_stitched(canvas, data_dir, timestamp, output_format)
+    if canvas_raw_path is not None:
+        del canvas
+        os.remove(canvas_raw_path)
+    if writer is not None:
+        writer.join()
+        print(f"瓦片原始字节已留档到: {keep_tiles_dir}")
+    print(f"\n拼接完成！完整图像已保存为: {output_filepath}")
+    return True
+
 def download_tiles(session, timestamp, temp_dir, concurrency):
     print(f"\n开始使用 {concurrency} 个并发线程下载或验证时间戳为 {timestamp} 的卫星瓦片...")
     os.makedirs(temp_dir, exist_ok=True)
-    tasks = [(x, y) for y in range(GRID_HEIGHT) for x in range(GRID_WIDTH)]
+    if aiohttp is not None and os.getenv('FY4B_ASYNC'):
+        asyncio.run(_download_tiles_async(timestamp, temp_dir, concurrency))
+        _validate_downloaded_tiles(temp_dir)
+        print("\n所有瓦片下载/验证完成。")
+        return True
+    tasks = [(x, y) for x in range(GRID_WIDTH) for y in range(GRID_HEIGHT) if (x, y) in DISK_TILES]
     with ThreadPoolExecutor(max_workers=concurrency) as executor:
         futures = [executor.submit(download_single_tile, session, timestamp, temp_dir, x, y) for x, y in tasks]
         with tqdm(total=len(tasks), desc="下载进度") as pbar:
             for future in as_completed(futures):
                 pbar.update(1)
+    _validate_downloaded_tiles(temp_dir)
     print("\n所有瓦片下载/验证完成。")
     return True
 
+def _quick_validate_tile(filepath):
+    """
+    头部体检：只读文件头33字节，不做任何解码。瓦片端点实际返回的是
+    JPEG字节（URL虽以.png结尾），校验SOI魔数即可；本地生成的空白瓦片
+    是真PNG，走签名+IHDR宽高校验。
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            header = f.read(33)
+        if header[:2] == b'\xff\xd8':
+            return True
+        if len(header) < 33 or header[:8] != b'\x89PNG\r\n\x1a\n':
+            return False
+        width = int.from_bytes(header[16:20], 'big')
+        height = int.from_bytes(header[20:24], 'big')
+        return width > 0 and height > 0
+    except OSError:
+        return False
+
+def _validate_downloaded_tiles(temp_dir):
+    """
+    下载完成后批量体检全部圆盘瓦片，截断/损坏的就地换成空白瓦片，
+    坏文件在进拼接前就被拦下，不再靠拼接线程的解码异常兜底。
+    """
+    bad = [(x, y) for x in range(GRID_WIDTH) for y in range(GRID_HEIGHT)
+           if (x, y) in DISK_TILES
+           and not _quick_validate_tile(os.path.join(temp_dir, f"tile_{x}_{y}.png"))]
+    for x, y in bad:
+        filepath = os.path.join(temp_dir, f"tile_{x}_{y}.png")
+        print(f"警告: 瓦片 ({x},{y}) 损坏或缺失，替换为空白瓦片。")
+        create_blank_tile(filepath)
+    if not bad:
+        print("瓦片体检通过：所有瓦片头部完好。")
+
+# 画布超过此阈值时自动切换为文件背书的memmap（FY4B_MMAP_CANVAS=1可强制）
+_MMAP_CANVAS_THRESHOLD = 512 * 1024 * 1024
+
+def _alloc_canvas(height, width):
+    """
+    分配拼接画布。画布超过512MB或FY4B_MMAP_CANVAS=1时改用临时文件上的
+    np.memmap，由内核按页换入换出，大画布不再常驻RSS；编码时从映射
+    内存流式读出。返回 (画布, 临时文件路径或None)，调用方负责在保存后
+    删除临时文件。
+    """
+    if os.getenv('FY4B_MMAP_CANVAS') or height * width * 3 > _MMAP_CANVAS_THRESHOLD:
+        import tempfile
+        fd, raw_path = tempfile.mkstemp(suffix='.raw', prefix='fy4b_canvas_')
+        os.close(fd)
+        return np.memmap(raw_path, dtype=np.uint8, mode='w+', shape=(height, width, 3)), raw_path
+    return np.empty((height, width, 3), dtype=np.uint8), None
+
+def _stitched_output_path(data_dir, timestamp, output_format='png'):
+    """拼接图的输出路径；扩展名由FY4B_STITCH_TIFF与output_format决定。"""
+    if tifffile is not None and os.getenv('FY4B_STITCH_TIFF'):
+        ext = '.tif'
+    elif output_format == 'jpeg':
+        ext = '.jpg'
+    elif output_format == 'webp':
+        ext = '.webp'
+    else:
+        ext = '.png'
+    return os.path.join(data_dir, f"fy4b_full_disk_{timestamp}{ext}")
+
+def _save_stitched(canvas, data_dir, timestamp, output_format='png'):
+    """
+    保存拼接画布并返回输出路径。FY4B_STITCH_TIFF=1且装有tifffile时写
+    1024×1024分块的deflate TIFF，各块由线程池并行压缩；否则按
+    output_format写PNG（快速压缩级）、JPEG或WebP——后两者对卫星
+    照片类内容编码更快、文件更小，代价是有损。
+    用deflate而非zstd是为了让Pillow也能直接读取下游文件。
+    """
+    output_filepath = _stitched_output_path(data_dir, timestamp, output_format)
+    if tifffile is not None and os.getenv('FY4B_STITCH_TIFF'):
+        tifffile.imwrite(
+            output_filepath, canvas, tile=(1024, 1024),
+            compression='zlib', compressionargs={'level': 1},
+            maxworkers=os.cpu_count() or 1
+        )
+    elif output_format == 'jpeg':
+        Image.fromarray(canvas).save(output_filepath, quality=92)
+    elif output_format == 'webp':
+        Image.fromarray(canvas).save(output_filepath, quality=90, method=4)
+    else:
+        Image.fromarray(canvas).save(output_filepath, compress_level=PNG_COMPRESS_LEVEL)
+    return output_filepath
+
+def _remove_temp_dir(temp_dir):
+    """
+    删除瓦片临时目录。目录结构是已知的扁平一层，直接scandir+unlink
+    即可，省去shutil.rmtree对每个条目的类型判断与递归开销。
+    """
+    with os.scandir(temp_dir) as it:
+        for entry in it:
+            os.unlink(entry.path)
+    os.rmdir(temp_dir)
+
+# 空白瓦片的PNG字节对每次失败都完全相同，编码一次后直接复用
+_BLANK_TILE_CACHE = {}
+
 def create_blank_tile(filepath, size=(256, 256), color='black'):
     try:
-        img = Image.new('RGB', size, color)
-        img.save(filepath)
+        key = (size, color)
+        if key not in _BLANK_TILE_CACHE:
+            buf = io.BytesIO()
+            Image.new('RGB', size, color).save(buf, 'PNG')
+            _BLANK_TILE_CACHE[key] = buf.getvalue()
+        with open(filepath, 'wb') as f:
+            f.write(_BLANK_TILE_CACHE[key])
     except Exception as e:
         print(f"创建空白图片 {filepath} 失败: {e}")
 
-def stitch_tiles(timestamp, temp_dir, data_dir):
+def _stitch_via_vips(timestamp, temp_dir, data_dir, tile_width, tile_height):
+    """
+    pyvips后端：arrayjoin把256块瓦片组成一条按需求值的流水线，
+    解码、拼接、编码边扫描边进行，整幅画布从不在内存中完整出现。
+    """
+    import pyvips
+
+    tiles = []
+    # 画布行号是x、列号是y，按行主序排列后across=每行瓦片数
+    for x in range(GRID_WIDTH):
+        for y in range(GRID_HEIGHT):
+            filepath = os.path.join(temp_dir, f"tile_{x}_{y}.png")
+            if (x, y) in DISK_TILES and os.path.exists(filepath):
+                tiles.append(pyvips.Image.new_from_file(filepath, access='sequential').colourspace('srgb')[:3])
+            else:
+                tiles.append(pyvips.Image.black(tile_width, tile_height, bands=3))
+    joined = pyvips.Image.arrayjoin(tiles, across=GRID_HEIGHT)
+    output_filepath = os.path.join(data_dir, f"fy4b_full_disk_{timestamp}.png")
+    joined.write_to_file(output_filepath, compression=PNG_COMPRESS_LEVEL)
+    return output_filepath
+
+def stitch_tiles(timestamp, temp_dir, data_dir, output_format='png'):
     print("\n开始拼接瓦片...")
+    # 幂等：上一轮崩溃后续跑时拼接图可能已经在了，直接跳过256次解码
+    # 与整幅重编码。瓦片写入是.part+原子改名，输出只会是完整文件
+    existing = _stitched_output_path(data_dir, timestamp, output_format)
+    if os.path.exists(existing) and os.path.getsize(existing) > MIN_IMAGE_SIZE_BYTES:
+        print(f"拼接图已存在，跳过拼接: {existing}")
+        return True
+    # 瓦片文件名是确定的，直接探圆盘中心那一块读尺寸（下载失败时也有
+    # 空白瓦片兜底），省掉整个目录的listdir扫描
+    sample_tile_path = os.path.join(temp_dir, f"tile_{GRID_WIDTH // 2}_{GRID_HEIGHT // 2}.png")
     try:
-        sample_tile_path = next(os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.endswith('.png'))
         with Image.open(sample_tile_path) as sample_tile:
             tile_width, tile_height = sample_tile.size
-    except (StopIteration, FileNotFoundError, Image.UnidentifiedImageError) as e:
+    except (FileNotFoundError, Image.UnidentifiedImageError) as e:
         print(f"错误: 无法确定瓦片尺寸，可能是所有瓦片都下载失败了。错误: {e}")
         return False
+    if os.getenv('FY4B_USE_VIPS'):
+        try:
+            output_filepath = _stitch_via_vips(timestamp, temp_dir, data_dir, tile_width, tile_height)
+            print(f"\n拼接完成！完整图像已保存为: {output_filepath}")
+            return True
+        except ImportError:
+            print("Warning: FY4B_USE_VIPS is set but pyvips is not installed. Falling back to NumPy stitching.")
+        except Exception as e:
+            print(f"pyvips拼接失败 ({e})，回退到NumPy拼接。")
     full_width = tile_width * GRID_HEIGHT
     full_height = tile_height * GRID_WIDTH
-    full_image = Image.new('RGB', (full_width, full_height))
+    # np.empty跳过整幅画布的零填充（16k×16k约750MB的无谓写入），
+    # 每块瓦片解码后直接写进对应切片，缺失的瓦片单独清零
+    canvas, canvas_raw_path = _alloc_canvas(full_height, full_width)
     print(f"画布尺寸: {full_width}x{full_height} 像素")
+
+    # 圆盘外的角落瓦片从未下载，主线程直接置黑，不占用解码线程池
     for x in range(GRID_WIDTH):
         for y in range(GRID_HEIGHT):
-            filepath = os.path.join(temp_dir, f"tile_{x}_{y}.png")
-            try:
-                with Image.open(filepath) as tile:
-                    paste_x = y * tile_width
-                    paste_y = x * tile_height
-                    full_image.paste(tile, (paste_x, paste_y))
-            except (FileNotFoundError, Image.UnidentifiedImageError):
-                print(f"警告: 瓦片 {filepath} 无效或不存在，该区域将留空。")
-    output_filename = f"fy4b_full_disk_{timestamp}.png"
-    output_filepath = os.path.join(data_dir, output_filename)
-    full_image.save(output_filepath)
+            if (x, y) not in DISK_TILES:
+                canvas[x * tile_height:(x + 1) * tile_height, y * tile_width:(y + 1) * tile_width] = 0
+
+    def _decode_and_blit(x, y):
+        # PNG解码在libpng内释放GIL，多线程可真正并行；各瓦片的切片互不重叠，
+        # 工作线程直接写入画布无需加锁
+        filepath = os.path.join(temp_dir, f"tile_{x}_{y}.png")
+        paste_x = y * tile_width
+        paste_y = x * tile_height
+        try:
+            with Image.open(filepath) as tile:
+                canvas[paste_y:paste_y + tile_height, paste_x:paste_x + tile_width] = _tile_to_rgb_array(tile)
+        except (FileNotFoundError, Image.UnidentifiedImageError):
+            print(f"警告: 瓦片 {filepath} 无效或不存在，该区域将留空。")
+            canvas[paste_y:paste_y + tile_height, paste_x:paste_x + tile_width] = 0
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+        futures = [executor.submit(_decode_and_blit, x, y)
+                   for x in range(GRID_WIDTH) for y in range(GRID_HEIGHT) if (x, y) in DISK_TILES]
+        for future in as_completed(futures):
+            future.result()
+    if canvas_raw_path is not None:
+        # 编码前把脏页刷回文件，保证映射内存与底层文件一致
+        canvas.flush()
+    output_filepath = _save_stitched(canvas, data_dir, timestamp, output_format)
+    if canvas_raw_path is not None:
+        del canvas
+        os.remove(canvas_raw_path)
     print(f"\n拼接完成！完整图像已保存为: {output_filepath}")
     return True
+def run(timestamp, data_dir, output_format='png', concurrency=None, keep_tiles=False):
+    """
+    下载并拼接单个时间戳的完整入口，供main_workflow进程内调用
+    （免去每轮一次的解释器/numpy/PIL冷启动）。返回True/False。
+    keep_tiles仅对内存模式有意义：拼接的同时后台落盘瓦片字节留档。
+    """
+    if concurrency is None:
+        concurrency = int(os.getenv('DOWNLOAD_CONCURRENCY', 10))
+    os.makedirs(data_dir, exist_ok=True)
+
+    with requests.Session() as session:
+        session.headers.update(HEADERS)
+        # 默认HTTPAdapter的连接池只有10条，并发线程更多时连接会被反复
+        # 建立/丢弃；按并发度放大池子，让所有线程都能复用keep-alive连接。
+        # 5xx响应在传输层按指数退避重试，不占用上层的三次业务重试
+        retry = requests.adapters.Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+        adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency, max_retries=retry)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        if not (len(timestamp) == 14 and timestamp.isdigit()):
+            print(f"错误: 时间戳 '{timestamp}' 格式不正确。")
+            return False
+
+        print(f"将使用时间戳: {timestamp}")
+
+        # 内存拼接模式：瓦片字节留在字典里直接解码进画布，不经过瓦片
+        # 文件（无断点续传）；keep_tiles时由后台线程顺带落盘留档
+        if os.getenv('FY4B_IN_MEMORY'):
+            tile_bytes = download_tile_bytes(session, timestamp, concurrency)
+            keep_dir = os.path.join(data_dir, 'temp_tiles', timestamp) if keep_tiles else None
+            if not stitch_tiles_from_memory(tile_bytes, timestamp, data_dir, output_format, keep_tiles_dir=keep_dir):
+                return False
+            print("\n任务成功完成！")
+            return True
+
+        temp_base_dir = os.path.join(data_dir, 'temp_tiles')
+        temp_dir_for_timestamp = os.path.join(temp_base_dir, timestamp)
+
+        try:
+            if not download_tiles(session, timestamp, temp_dir_for_timestamp, concurrency):
+                return False
+
+            if not stitch_tiles(timestamp, temp_dir_for_timestamp, data_dir, output_format):
+                return False
+
+            print("\n任务成功完成！")
+            _remove_temp_dir(temp_dir_for_timestamp)
+            print(f"临时文件夹 '{temp_dir_for_timestamp}' 已自动删除。")
+            return True
+
+        except Exception as e:
+            print(f"\n脚本执行过程中发生未预料的错误: {e}")
+            print(f"临时文件已保留在 '{temp_dir_for_timestamp}' 文件夹中，以便进行问题排查。")
+            return False
+
 def main():
     load_dotenv() # 加载 .env 文件
     parser = argparse.ArgumentParser(
@@ -107,40 +567,14 @@ def main():
     parser.add_argument(
         '-d', '--data-dir', type=str, default='./data', help="所有输出文件（临时瓦片、最终图像）的基础目录。默认为 './data'"
     )
+    parser.add_argument(
+        '--output-format', type=str, default='png', choices=['png', 'jpeg', 'webp'],
+        help="拼接图的输出格式。PNG用快速压缩级；JPEG/WebP编码更快且更小（有损）。默认为 png"
+    )
     args = parser.parse_args()
 
-    # --- 从环境变量读取配置 ---
-    concurrency = int(os.getenv('DOWNLOAD_CONCURRENCY', 10)) # 默认值为 10
-
-    os.makedirs(args.data_dir, exist_ok=True)
-
-    with requests.Session() as session:
-        session.headers.update(HEADERS)
-        
-        target_timestamp = args.timestamp
-        if not (len(target_timestamp) == 14 and target_timestamp.isdigit()):
-            print(f"错误: 时间戳 '{target_timestamp}' 格式不正确。")
-            return
-        
-        print(f"将使用时间戳: {target_timestamp}")
-        
-        temp_base_dir = os.path.join(args.data_dir, 'temp_tiles')
-        temp_dir_for_timestamp = os.path.join(temp_base_dir, target_timestamp)
-        
-        try:
-            download_success = download_tiles(session, target_timestamp, temp_dir_for_timestamp, concurrency)
-            if not download_success: return
-
-            stitch_success = stitch_tiles(target_timestamp, temp_dir_for_timestamp, args.data_dir)
-            if not stitch_success: return
-            
-            print("\n任务成功完成！")
-            shutil.rmtree(temp_dir_for_timestamp)
-            print(f"临时文件夹 '{temp_dir_for_timestamp}' 已自动删除。")
-
-        except Exception as e:
-            print(f"\n脚本执行过程中发生未预料的错误: {e}")
-            print(f"临时文件已保留在 '{temp_dir_for_timestamp}' 文件夹中，以便进行问题排查。")
+    if not run(args.timestamp, args.data_dir, output_format=args.output_format):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,71 +1,136 @@
 import os
 import argparse
+import numpy as np
 from osgeo import gdal, osr
 
+GEOS_PROJ4 = "+proj=geos +h=35785831 +lon_0=104.90 +sweep=x +datum=WGS84 +units=m"
+GEOS_EXTENT = (-5568748.0, 5568748.0, -5568748.0, 5568748.0)  # x_min, x_max, y_min, y_max
+
+# SRS与坐标变换在模块级构建一次：每次新建都要查PROJ的EPSG数据库，
+# 成本远高于变换本身
+_SRS_4326 = osr.SpatialReference()
+_SRS_4326.ImportFromEPSG(4326)
+# 确保轴序为 (经度, 纬度)
+if hasattr(_SRS_4326, 'SetAxisMappingStrategy'):
+    _SRS_4326.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+_SRS_3857 = osr.SpatialReference()
+_SRS_3857.ImportFromEPSG(3857)
+_TRANSFORM_4326_TO_3857 = osr.CoordinateTransformation(_SRS_4326, _SRS_3857)
+
 def transform_bbox_4326_to_3857(north, south, west, east):
     """将WGS84 (EPSG:4326)经纬度边界框转换为Web墨卡托 (EPSG:3857)坐标。"""
-    srs_4326 = osr.SpatialReference()
-    srs_4326.ImportFromEPSG(4326)
-    
-    srs_3857 = osr.SpatialReference()
-    srs_3857.ImportFromEPSG(3857)
-    
-    # 确保轴序为 (经度, 纬度)
-    if hasattr(srs_4326, 'SetAxisMappingStrategy'):
-        srs_4326.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
-    
-    transform = osr.CoordinateTransformation(srs_4326, srs_3857)
-    
-    # 左下角 (west, south)
-    # 右上角 (east, north)
-    min_x_mercator, min_y_mercator, _ = transform.TransformPoint(west, south)
-    max_x_mercator, max_y_mercator, _ = transform.TransformPoint(east, north)
-    
+    # 左下角 (west, south)，右上角 (east, north)，一次调用批量变换
+    (min_x_mercator, min_y_mercator, _), (max_x_mercator, max_y_mercator, _) = \
+        _TRANSFORM_4326_TO_3857.TransformPoints([(west, south), (east, north)])
     return [min_x_mercator, min_y_mercator, max_x_mercator, max_y_mercator]
 
-def georeference_and_reproject(input_image_path, output_geotiff_path, bbox_4326=None):
+def _reproject_on_gpu(src_ds, output_geotiff_path, bbox_4326, output_width=4096):
+    """
+    GPU重投影（FY4B_GPU=1且装有cupy时启用，仅裁剪模式）：
+    用pyproj把输出网格从Web墨卡托批量逆变换到geos源像素坐标，
+    再在GPU上用map_coordinates对三个波段做双线性采样。
+    重采样是逐像素独立的，正适合GPU的大规模并行。
+    """
+    import cupy as cp
+    from cupyx.scipy.ndimage import map_coordinates
+    from pyproj import Transformer
+
+    xmin, ymin, xmax, ymax = transform_bbox_4326_to_3857(**bbox_4326)
+    out_w = output_width
+    out_h = int(round(out_w * (ymax - ymin) / (xmax - xmin)))
+
+    xs = np.linspace(xmin, xmax, out_w)
+    ys = np.linspace(ymax, ymin, out_h)
+    xm, ym = np.meshgrid(xs, ys)
+    transformer = Transformer.from_crs('EPSG:3857', GEOS_PROJ4, always_xy=True)
+    gx, gy = transformer.transform(xm, ym)
+
+    src_w, src_h = src_ds.RasterXSize, src_ds.RasterYSize
+    x_min, x_max, y_min, y_max = GEOS_EXTENT
+    px = (gx - x_min) / (x_max - x_min) * src_w
+    py = (y_max - gy) / (y_max - y_min) * src_h
+    valid = np.isfinite(px) & np.isfinite(py) & (px >= 0) & (px < src_w) & (py >= 0) & (py < src_h)
+    # 无效坐标指到采样范围外，由cval=0兜底
+    coords = cp.asarray(np.stack([np.where(valid, py, -2.0), np.where(valid, px, -2.0)]))
+
+    out = np.empty((out_h, out_w, 3), dtype=np.uint8)
+    for band in range(3):
+        src_gpu = cp.asarray(src_ds.GetRasterBand(band + 1).ReadAsArray())
+        out[..., band] = cp.asnumpy(map_coordinates(src_gpu, coords, order=1, mode='constant', cval=0))
+
+    driver = gdal.GetDriverByName('GTiff')
+    dst_ds = driver.Create(output_geotiff_path, out_w, out_h, 4, gdal.GDT_Byte,
+                           options=['COMPRESS=LZW', 'TILED=YES', 'PREDICTOR=2', 'NUM_THREADS=ALL_CPUS'])
+    dst_ds.SetProjection(_SRS_3857.ExportToWkt())
+    dst_ds.SetGeoTransform([xmin, (xmax - xmin) / out_w, 0, ymax, 0, -(ymax - ymin) / out_h])
+    for band in range(3):
+        dst_ds.GetRasterBand(band + 1).WriteArray(out[..., band])
+    alpha_band = dst_ds.GetRasterBand(4)
+    alpha_band.WriteArray((valid * 255).astype(np.uint8))
+    alpha_band.SetColorInterpretation(gdal.GCI_AlphaBand)
+    dst_ds = None
+    print("--- GPU reprojection successful! ---")
+
+def georeference_and_reproject(input_image, output_geotiff_path, bbox_4326=None):
     """
     为无地理信息的风云4B全圆盘图像添加地理参考，并将其重投影为Web墨卡托。
-    支持可选的地理范围裁剪。
+    支持可选的地理范围裁剪。input_image可以是图像文件路径，也可以是
+    已打开的gdal.Dataset（例如拼接流水线传入的MEM数据集，免去PNG的
+    编码/解码往返）。
     """
-    print(f"--- Step 1: Opening input image: {input_image_path} ---")
-    if not os.path.exists(input_image_path):
-        print(f"Error: Input file not found at '{input_image_path}'")
-        return
+    # 块缓存从默认40MB提到4GB：重采样时同一批源块会被相邻输出块反复用到
+    gdal.SetCacheMax(4 * 1024 ** 3)
 
-    src_ds = gdal.Open(input_image_path, gdal.GA_ReadOnly)
-    if src_ds is None:
-        print("Error: Could not open the input image with GDAL.")
-        return
+    if isinstance(input_image, str):
+        print(f"--- Step 1: Opening input image: {input_image} ---")
+        if not os.path.exists(input_image):
+            print(f"Error: Input file not found at '{input_image}'")
+            return
+        src_ds = gdal.Open(input_image, gdal.GA_ReadOnly)
+        if src_ds is None:
+            print("Error: Could not open the input image with GDAL.")
+            return
+    else:
+        print("--- Step 1: Using already-open in-memory dataset ---")
+        src_ds = input_image
 
     width = src_ds.RasterXSize
     height = src_ds.RasterYSize
     print(f"Image dimensions: {width}x{height}")
 
+    if bbox_4326 and os.getenv('FY4B_GPU'):
+        try:
+            _reproject_on_gpu(src_ds, output_geotiff_path, bbox_4326)
+            return
+        except ImportError:
+            print("Warning: FY4B_GPU is set but cupy/pyproj is not installed. Falling back to CPU warp.")
+        except Exception as e:
+            print(f"GPU reprojection failed ({e}); falling back to CPU warp.")
+
     srs_source = osr.SpatialReference()
     # proj4_string = "+proj=geos +h=35785831 +lon_0=105 +sweep=x +datum=WGS84 +units=m +x_0=16000 +y_0=30000"
-    proj4_string = "+proj=geos +h=35785831 +lon_0=104.90 +sweep=x +datum=WGS84 +units=m"
-    srs_source.ImportFromProj4(proj4_string)
-    
-    x_min, x_max, y_min, y_max = -5568748.0, 5568748.0, -5568748.0, 5568748.0
+    srs_source.ImportFromProj4(GEOS_PROJ4)
+
+    x_min, x_max, y_min, y_max = GEOS_EXTENT
     geotransform = [x_min, (x_max - x_min) / width, 0, y_max, 0, (y_min - y_max) / height]
 
-    vrt_path = "temp_georeferenced.vrt"
-    driver = gdal.GetDriverByName('VRT')
-    vrt_ds = driver.CreateCopy(vrt_path, src_ds)
+    # VRT只存在于内存中：免去临时文件的写入/重开/删除，warp直接用已打开的数据集
+    vrt_ds = gdal.GetDriverByName('VRT').CreateCopy('', src_ds)
     vrt_ds.SetProjection(srs_source.ExportToWkt())
     vrt_ds.SetGeoTransform(geotransform)
     vrt_ds.SetMetadataItem("SATELLITE", "Fengyun-4B (FY-4B)")
-    vrt_ds = None
-    src_ds = None
-    print(f"--- Step 2: Created virtual georeferenced file at '{vrt_path}' ---")
+    print("--- Step 2: Created in-memory georeferenced VRT ---")
 
+    # 多线程warp：重采样按块分给所有核心；PREDICTOR=2让LZW压得更小，省写带宽
     warp_options_dict = {
         'dstSRS': 'EPSG:3857',
         'format': 'GTiff',
         'resampleAlg': gdal.GRA_Bilinear,
         'dstAlpha': True,
-        'creationOptions': ['COMPRESS=LZW', 'TILED=YES']
+        'multithread': True,
+        'warpMemoryLimit': 2 * 1024 ** 3,
+        'warpOptions': ['NUM_THREADS=ALL_CPUS'],
+        'creationOptions': ['COMPRESS=LZW', 'TILED=YES', 'PREDICTOR=2', 'NUM_THREADS=ALL_CPUS', 'BIGTIFF=IF_SAFER']
     }
 
     if bbox_4326:
@@ -87,14 +152,13 @@ def georeference_and_reproject(input_image_path, output_geotiff_path, bbox_4326=
     
     print(f"\n--- Step 3: Reprojecting to Web Mercator -> {output_geotiff_path} ---")
     try:
-        gdal.Warp(output_geotiff_path, vrt_path, options=warp_options)
+        gdal.Warp(output_geotiff_path, vrt_ds, options=warp_options)
         print("--- Reprojection successful! ---")
     except Exception as e:
         print(f"An error occurred during reprojection: {e}")
     finally:
-        if os.path.exists(vrt_path):
-            os.remove(vrt_path)
-            print(f"--- Step 4: Cleaned up temporary file '{vrt_path}' ---")
+        vrt_ds = None
+        src_ds = None
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -5,10 +5,25 @@ import argparse
 import subprocess
 import requests
 import json
-import time
-import schedule
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
 
+# requests-cache可选：探测响应进sqlite缓存，重复探测命中本地直接返回
+try:
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
+# orjson可选：编解码比stdlib json快数倍且直接产出bytes，失败日志
+# 每轮都要读写，省掉这点热循环里的Python开销
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # --- 配置区---
 BASE_URL_TEMPLATE = "http://rsapp.nsmc.org.cn/swapQuery/public/tileServer/getTile/fy-4b/full_disk/NatureColor_NoLit/{timestamp}/jpg/0/0/0.png"
 HEADERS = {'User-Agent': 'Mozilla/5.0'}
@@ -20,57 +35,414 @@ def read_failed_log(data_dir):
     log_path = os.path.join(data_dir, FAILED_LOG_FILENAME)
     if os.path.exists(log_path):
         try:
-            with open(log_path, 'r') as f: return json.load(f)
-        except json.JSONDecodeError: return []
+            with open(log_path, 'rb') as f:
+                return orjson.loads(f.read()) if orjson is not None else json.load(f)
+        except (json.JSONDecodeError, ValueError): return []
     return []
 
 def write_failed_log(data_dir, timestamps):
+    # 先写.tmp再原子替换：崩溃不会留下截断的半个JSON
     log_path = os.path.join(data_dir, FAILED_LOG_FILENAME)
-    with open(log_path, 'w') as f: json.dump(timestamps, f, indent=2)
+    tmp_path = log_path + '.tmp'
+    if orjson is not None:
+        with open(tmp_path, 'wb') as f: f.write(orjson.dumps(timestamps, option=orjson.OPT_INDENT_2))
+    else:
+        with open(tmp_path, 'w') as f: json.dump(timestamps, f, indent=2)
+    os.replace(tmp_path, log_path)
+
+class FailedQueue:
+    """
+    failed_timestamps.json的内存镜像：启动时读盘一次，之后增删都先改
+    内存再整体落盘。省去每轮多次的重复打开+解析，也消除了旧代码里
+    两次读取之间的TOCTOU窗口；磁盘文件始终是内存状态的原子快照。
+    内部用OrderedDict当有序集合：天然去重，且长度封顶96（24小时的
+    15分钟槽位）——服务器断上几天时挤掉最旧的条目，而不是无限增长。
+    磁盘格式仍是时间戳列表，向后兼容。
+    """
+    MAX_ENTRIES = 96
+
+    def __init__(self, data_dir):
+        self._data_dir = data_dir
+        self._lock = threading.Lock()
+        self._items = OrderedDict((ts, None) for ts in read_failed_log(data_dir))
+        while len(self._items) > self.MAX_ENTRIES:
+            self._items.popitem(last=False)
+
+    def items(self):
+        with self._lock:
+            return list(self._items)
+
+    def add(self, timestamp):
+        with self._lock:
+            self._items[timestamp] = None
+            self._items.move_to_end(timestamp)
+            while len(self._items) > self.MAX_ENTRIES:
+                dropped, _ = self._items.popitem(last=False)
+                print(f"--- 失败队列已满，丢弃最旧的时间戳: {dropped} ---")
+            write_failed_log(self._data_dir, list(self._items))
+
+    def remove(self, timestamp):
+        with self._lock:
+            if timestamp in self._items:
+                del self._items[timestamp]
+                write_failed_log(self._data_dir, list(self._items))
+
+    def replace(self, timestamps):
+        with self._lock:
+            self._items = OrderedDict((ts, None) for ts in timestamps)
+            while len(self._items) > self.MAX_ENTRIES:
+                self._items.popitem(last=False)
+            write_failed_log(self._data_dir, list(self._items))
+
+# 失败队列单例：守护进程整个生命周期共用一份内存状态
+_FAILED_QUEUE = None
+
+def get_failed_queue(data_dir):
+    global _FAILED_QUEUE
+    if _FAILED_QUEUE is None:
+        _FAILED_QUEUE = FailedQueue(data_dir)
+    return _FAILED_QUEUE
+
+def _is_image_content_type(response):
+    """
+    Content-Type按小写比对：服务器偶尔返回'Image/JPEG'之类的大写变体，
+    大小写敏感的子串判断会把可用数据误判为不可用，引发无谓的重探。
+    """
+    content_type = response.headers.get('Content-Type', '').lower()
+    return 'image/' in content_type or 'octet-stream' in content_type
+
+# 探测默认用HEAD（只传响应头不传图片体）；服务器拒绝HEAD时降级GET并记住
+_PROBE_USE_HEAD = True
+
+def _probe_timestamp(session, test_url):
+    """探测单个时间戳的z=0瓦片是否可用，返回 (是否可用, 状态码)。"""
+    global _PROBE_USE_HEAD
+    if _PROBE_USE_HEAD:
+        response = session.head(test_url, timeout=10, allow_redirects=True)
+        if response.status_code in (403, 405):
+            print("服务器不支持HEAD探测，降级为GET。")
+            _PROBE_USE_HEAD = False
+        else:
+            ok = response.status_code == 200 and _is_image_content_type(response)
+            return ok, response.status_code
+    # GET降级路径只要前2个字节：Range头让响应体从几十KB缩到2字节，
+    # 顺带校验图片魔数（瓦片实为JPEG，兼容PNG签名；忽略Range的服务器
+    # 返回200，也同样只读2字节就关掉连接）
+    response = session.get(test_url, headers={'Range': 'bytes=0-1'}, stream=True, timeout=15)
+    ok = response.status_code in (200, 206) and _is_image_content_type(response)
+    if ok:
+        try:
+            magic = response.raw.read(2)
+        except (OSError, AttributeError):
+            magic = b''
+        if magic:
+            ok = magic in (b'\xff\xd8', b'\x89P')
+    response.close()
+    return ok, response.status_code
+
+def _mount_retry_adapter(session):
+    """
+    给会话装上传输层重试：连接重置、陈旧连接与5xx都在进程内按指数
+    退避重试（尊重Retry-After头），而不是让一次网络抖动浪费整轮
+    15分钟的调度周期、把时间戳白白压进失败队列。
+    """
+    retry = requests.adapters.Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=["GET", "HEAD"],
+        respect_retry_after_header=True,
+    )
+    adapter = requests.adapters.HTTPAdapter(max_retries=retry, pool_connections=20, pool_maxsize=20)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _probe_session():
+    """
+    构建探测用会话。装有requests-cache时，z=0探测响应缓存进本地sqlite
+    （200和404都缓存10分钟，并尊重服务器的Cache-Control头）：守护进程
+    每轮重复探测同一批时间戳时直接命中本地，不再产生网络流量。
+    """
+    if requests_cache is not None:
+        session = requests_cache.CachedSession(
+            cache_name='.probe_cache',
+            backend='sqlite',
+            expire_after=600,
+            cache_control=True,
+            allowable_codes=(200, 404),
+        )
+    else:
+        session = requests.Session()
+    return _mount_retry_adapter(session)
+
+# 进程级会话单例：keep-alive连接跨调度周期存活，每轮探测省掉
+# TCP+HTTP握手；连接回收交给urllib3的连接池
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+def get_session():
+    """懒初始化的进程级探测会话（带重试适配器与默认请求头）。"""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = _probe_session()
+            _SESSION.headers.update(HEADERS)
+    return _SESSION
+
+# 上一轮找到的最新时间戳及其缓存校验器（ETag/Last-Modified），
+# 守护进程生命周期内有效；下一轮先对它发条件请求，304即免传响应体
+_LAST_GOOD = {'timestamp': None, 'etag': None, 'last_modified': None}
+
+def _revalidate_last_good(session):
+    """
+    条件请求复核上一轮的最新时间戳是否仍可用。返回True/False；
+    200时顺带刷新校验器，供下一轮继续走304路径。
+    """
+    headers = {}
+    if _LAST_GOOD['etag']:
+        headers['If-None-Match'] = _LAST_GOOD['etag']
+    if _LAST_GOOD['last_modified']:
+        headers['If-Modified-Since'] = _LAST_GOOD['last_modified']
+    url = BASE_URL_TEMPLATE.format(timestamp=_LAST_GOOD['timestamp'])
+    try:
+        response = session.get(url, headers=headers, timeout=10)
+    except requests.exceptions.RequestException:
+        return False
+    if response.status_code == 304:
+        return True
+    if response.status_code == 200 and _is_image_content_type(response):
+        _LAST_GOOD['etag'] = response.headers.get('ETag')
+        _LAST_GOOD['last_modified'] = response.headers.get('Last-Modified')
+        return True
+    return False
+
+# 探测合并：同一个15分钟窗口内的并发调用共享一次探测结果
+_PROBE_COALESCE_LOCK = threading.Lock()
+_PROBE_FUTURES = {}
 
 def find_latest_available_timestamp():
-    print("--- 自动查找最新的可用数据时间戳 ---")
+    """
+    查找最新可用时间戳，带请求合并：按15分钟窗口取键，窗口内第一个
+    调用者真正发探测请求，其余调用者等待并复用同一个Future的结果，
+    避免多线程/多worker同时探测造成的重复请求风暴。
+    """
+    now = datetime.now(timezone.utc)
+    window_key = now.replace(minute=(now.minute // 15) * 15, second=0, microsecond=0)
+    with _PROBE_COALESCE_LOCK:
+        for key in [k for k in _PROBE_FUTURES if now - k > timedelta(minutes=30)]:
+            del _PROBE_FUTURES[key]
+        future = _PROBE_FUTURES.get(window_key)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            _PROBE_FUTURES[window_key] = future
+    if is_owner:
+        try:
+            future.set_result(_find_latest_available_timestamp())
+        except BaseException as e:
+            future.set_exception(e)
+            with _PROBE_COALESCE_LOCK:
+                _PROBE_FUTURES.pop(window_key, None)
+    return future.result()
+
+def _candidate_timestamps(count=20):
+    """最近count个15分钟整点的时间戳字符串，从新到旧排列。"""
     now_utc = datetime.now(timezone.utc) - timedelta(minutes=15)
-    with requests.Session() as session:
-        session.headers.update(HEADERS)
-        for i in range(20):
-            check_time = now_utc - timedelta(minutes=i * 15)
-            minute = (check_time.minute // 15) * 15
-            dt_valid = check_time.replace(minute=minute, second=0, microsecond=0)
-            timestamp_to_check = dt_valid.strftime("%Y%m%d%H%M%S")
-            test_url = BASE_URL_TEMPLATE.format(timestamp=timestamp_to_check)
-            try:
-                response = session.get(test_url, timeout=15)
-                if response.status_code == 200 and 'image' in response.headers.get('Content-Type', ''):
-                    print(f"成功找到可用时间戳: {timestamp_to_check}")
-                    return timestamp_to_check
-            except requests.exceptions.RequestException as e:
-                print(f"查找时间戳时网络错误: {e}。可能服务器暂时不可用。")
-                return None
-            time.sleep(0.5)
+    candidates = []
+    for i in range(count):
+        check_time = now_utc - timedelta(minutes=i * 15)
+        minute = (check_time.minute // 15) * 15
+        dt_valid = check_time.replace(minute=minute, second=0, microsecond=0)
+        candidates.append(dt_valid.strftime("%Y%m%d%H%M%S"))
+    return candidates
+
+def _find_latest_available_timestamp():
+    print("--- 自动查找最新的可用数据时间戳 ---")
+    candidates = _candidate_timestamps()
+    session = get_session()
+
+    # 快路径：上一轮的结果还在候选窗口内时，一个条件请求（通常304）
+    # 确认它仍可用，然后只探测比它更新的少数候选，而不是全量20个
+    fallback = None
+    if _LAST_GOOD['timestamp'] in candidates and _revalidate_last_good(session):
+        fallback = _LAST_GOOD['timestamp']
+        candidates = candidates[:candidates.index(fallback)]
+        if not candidates:
+            print(f"最新时间戳未变化: {fallback}")
+            return fallback
+
+    # 分两波并发探测：先齐发最新4个候选（正常情况下最新数据就在这里，
+    # 4个请求、约1个RTT就收工），全miss才把剩余候选齐发兜底。比逐个
+    # 二分省RTT串联，比全量齐发省请求数
+    hits = []
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        for wave in (candidates[:4], candidates[4:]):
+            if not wave or hits:
+                break
+            offset = candidates.index(wave[0])
+            futures = {
+                executor.submit(_probe_timestamp, session, BASE_URL_TEMPLATE.format(timestamp=ts)): offset + index
+                for index, ts in enumerate(wave)
+            }
+            for future in as_completed(futures):
+                try:
+                    ok, _ = future.result()
+                except requests.exceptions.RequestException as e:
+                    print(f"查找时间戳时网络错误: {e}。该候选视为不可用。")
+                    continue
+                if ok:
+                    hits.append(futures[future])
+    if hits:
+        latest = candidates[min(hits)]
+        print(f"成功找到可用时间戳: {latest}")
+        if latest != _LAST_GOOD['timestamp']:
+            # 校验器下一轮的条件请求会顺带补上
+            _LAST_GOOD.update(timestamp=latest, etag=None, last_modified=None)
+        return latest
+    if fallback:
+        print(f"没有更新的数据，沿用时间戳: {fallback}")
+        return fallback
     return None
 
 def run_step(step_name, command):
     print(f"\n{'='*20}\n--- STEP: {step_name} ---\n{'='*20}")
     print(f"Executing: {' '.join(command)}")
+    process = None
     try:
-        subprocess.run(command, check=True, text=True)
-        print(f"--- STEP '{step_name}' COMPLETED SUCCESSFULLY ---")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"\n❌ ERROR: Step '{step_name}' failed with exit code {e.returncode}.")
+        # 逐行边读边打，同时在环形缓冲里留最后200行：输出实时可见、
+        # 内存有界，失败时还能给出带步骤名前缀的现场摘要（并行回补时
+        # 多个子进程的输出交错，失败原因不再淹没在滚动日志里）
+        # close_fds=False让CPython走posix_spawn而不是fork+exec，免去
+        # 复制守护进程页表的COW开销；这里没有需要对子进程隐藏的fd
+        process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, bufsize=1, close_fds=False
+        )
+        tail = deque(maxlen=200)
+        for line in process.stdout:
+            tail.append(line)
+            print(line, end='')
+        process.wait()
+        if process.returncode == 0:
+            print(f"--- STEP '{step_name}' COMPLETED SUCCESSFULLY ---")
+            return True
+        print(f"\n❌ ERROR: Step '{step_name}' failed with exit code {process.returncode}.")
+        if tail:
+            print(f"--- Last output of step '{step_name}': ---")
+            for line in list(tail)[-10:]:
+                print(f"  | {line}", end='')
         return False
     except KeyboardInterrupt:
+        if process is not None:
+            process.kill()
         print(f"\n🛑 Workflow interrupted by user at step '{step_name}'.")
         raise
     except Exception as e:
         print(f"An unexpected error occurred during step '{step_name}': {e}")
         return False
 
+def run_step_inproc(step_name, func, *func_args, **func_kwargs):
+    """与run_step相同的日志外壳，但直接调用函数而非启动子进程。"""
+    print(f"\n{'='*20}\n--- STEP: {step_name} ---\n{'='*20}")
+    try:
+        if func(*func_args, **func_kwargs):
+            print(f"--- STEP '{step_name}' COMPLETED SUCCESSFULLY ---")
+            return True
+        print(f"\n❌ ERROR: Step '{step_name}' failed.")
+        return False
+    except KeyboardInterrupt:
+        print(f"\n🛑 Workflow interrupted by user at step '{step_name}'.")
+        raise
+    except Exception as e:
+        print(f"An unexpected error occurred during step '{step_name}': {e}")
+        return False
+
+def _stage_skip_checks(timestamp, data_dir):
+    """
+    按产物探测各阶段是否已完成：本阶段产物、或任一更下游的产物存在
+    即视为完成（中间文件默认会被下一阶段删除，只剩下游产物是常态）。
+    create_tiles自带指纹缓存，不在这里跳过。重试只需补跑失败的阶段。
+    """
+    def _exists(name):
+        return os.path.exists(os.path.join(data_dir, name))
+
+    def stitched_done():
+        return any(_exists(f"fy4b_full_disk_{timestamp}{ext}") for ext in ('.png', '.tif', '.jpg', '.webp'))
+
+    def adjusted_done():
+        return _exists(f"fy4b_full_disk_{timestamp}_adjusted.png")
+
+    def mercator_done():
+        return _exists(f"fy4b_full_disk_{timestamp}_adjusted_mercator.tif")
+
+    return [
+        lambda: stitched_done() or adjusted_done() or mercator_done(),
+        lambda: adjusted_done() or mercator_done(),
+        mercator_done,
+        lambda: False,
+    ]
+
+_STAGE_MODULES = None
+
+def _load_stage_modules():
+    """
+    导入四个步骤模块并缓存（含失败结果）。首轮导入后numpy/PIL/GDAL
+    常驻守护进程，后续每轮零冷启动；环境缺重依赖时返回None，
+    调用方退回子进程模式。
+    """
+    global _STAGE_MODULES
+    if _STAGE_MODULES is None:
+        try:
+            import download_stitch
+            import adjust_padding
+            import create_geotiff
+            import create_tiles
+            _STAGE_MODULES = (download_stitch, adjust_padding, create_geotiff, create_tiles)
+        except ImportError as e:
+            print(f"进程内模式缺少依赖（{e}），退回子进程模式。")
+            _STAGE_MODULES = ()
+    return _STAGE_MODULES or None
+
+def _run_workflow_inproc(timestamp, args):
+    """
+    进程内执行四个步骤：省去每步约数百毫秒的解释器启动与numpy/PIL/GDAL
+    冷导入，且GDAL块缓存、PATH解析等在守护进程的多轮之间保持温热。
+    缺少重依赖时返回None，由调用方退回子进程模式。
+    """
+    modules = _load_stage_modules()
+    if modules is None:
+        return None
+    download_stitch, adjust_padding, create_geotiff, create_tiles = modules
+
+    keep = args.keep_files
+    steps = [
+        ("1. DOWNLOAD & STITCH", download_stitch.run, (timestamp, args.data_dir), {'keep_tiles': keep}),
+        ("2. ADJUST PADDING", adjust_padding.run, (timestamp, args.data_dir), {'keep_source': keep}),
+        ("3. CREATE GEOTIFF", create_geotiff.run, (timestamp, args.data_dir), {'keep_source': keep}),
+        ("4. CREATE TILES", create_tiles.run, (timestamp, args.data_dir), {}),
+    ]
+    for (name, func, func_args, func_kwargs), skip_check in zip(steps, _stage_skip_checks(timestamp, args.data_dir)):
+        if skip_check():
+            print(f"--- STEP '{name}' SKIPPED (output already exists) ---")
+            continue
+        if not run_step_inproc(name, func, *func_args, **func_kwargs):
+            return False
+
+    print(f"\n🎉🎉🎉 Workflow completed successfully for timestamp: {timestamp}! 🎉🎉🎉")
+    return True
+
 def run_workflow_for_timestamp(timestamp, args):
     """为单个时间戳执行完整的处理流程，并根据 args.keep_files 决定是否清理。"""
     print(f"\n>>> Starting workflow for timestamp: {timestamp} <<<")
-    
+
+    # 默认进程内直接调用各步骤的run()；--use-subprocess保留旧的
+    # 每步独立子进程模式，便于隔离排查单步问题
+    if not getattr(args, 'use_subprocess', False):
+        result = _run_workflow_inproc(timestamp, args)
+        if result is not None:
+            return result
+
     python_executable = sys.executable
     data_dir_args = ['-d', args.data_dir]
     
@@ -91,13 +463,72 @@ def run_workflow_for_timestamp(timestamp, args):
         ("4. CREATE TILES", cmd_tiles)
     ]
 
-    for name, command in steps:
+    for (name, command), skip_check in zip(steps, _stage_skip_checks(timestamp, args.data_dir)):
+        if skip_check():
+            print(f"--- STEP '{name}' SKIPPED (output already exists) ---")
+            continue
         if not run_step(name, command):
             return False
     
     print(f"\n🎉🎉🎉 Workflow completed successfully for timestamp: {timestamp}! 🎉🎉🎉")
     return True
 
+def run_workflows_pipelined(timestamps, args):
+    """
+    流水线处理多个时间戳：四个阶段各占一个线程，阶段间用容量2的队列
+    衔接——T在切片时T+1已在下载。吞吐从sum(各阶段耗时)降到
+    max(各阶段耗时)，回补积压时约快一半。返回 {时间戳: 是否成功}。
+    """
+    modules = _load_stage_modules()
+    if modules is None:
+        print("流水线模式不可用，退回逐个顺序处理。")
+        return {ts: run_workflow_for_timestamp(ts, args) for ts in timestamps}
+    download_stitch, adjust_padding, create_geotiff, create_tiles = modules
+
+    keep = args.keep_files
+    stages = [
+        ("1. DOWNLOAD & STITCH", lambda ts: download_stitch.run(ts, args.data_dir, keep_tiles=keep)),
+        ("2. ADJUST PADDING", lambda ts: adjust_padding.run(ts, args.data_dir, keep_source=keep)),
+        ("3. CREATE GEOTIFF", lambda ts: create_geotiff.run(ts, args.data_dir, keep_source=keep)),
+        ("4. CREATE TILES", lambda ts: create_tiles.run(ts, args.data_dir)),
+    ]
+    # 容量2的队列提供少量缓冲又避免快阶段把慢阶段的输入堆成山
+    stage_queues = [queue.Queue(maxsize=2) for _ in stages]
+    results = {}
+    results_lock = threading.Lock()
+
+    def stage_worker(index):
+        name, func = stages[index]
+        while True:
+            ts = stage_queues[index].get()
+            if ts is None:
+                # 哨兵沿流水线传递，依次关停下游
+                if index + 1 < len(stage_queues):
+                    stage_queues[index + 1].put(None)
+                return
+            success = False
+            try:
+                success = bool(func(ts))
+            except Exception as e:
+                print(f"[{ts}] Stage '{name}' raised an unexpected error: {e}")
+            if success and index + 1 < len(stage_queues):
+                stage_queues[index + 1].put(ts)
+            else:
+                if not success:
+                    print(f"[{ts}] ❌ Stage '{name}' failed; timestamp leaves the pipeline.")
+                with results_lock:
+                    results[ts] = success
+
+    workers = [threading.Thread(target=stage_worker, args=(i,), daemon=True) for i in range(len(stages))]
+    for worker in workers:
+        worker.start()
+    for ts in timestamps:
+        stage_queues[0].put(ts)
+    stage_queues[0].put(None)
+    for worker in workers:
+        worker.join()
+    return results
+
 # --- 将单次任务逻辑封装成一个函数 ---
 def run_scheduled_task(args):
     """
@@ -107,41 +538,68 @@ def run_scheduled_task(args):
     
     target_timestamp = None
     is_retry_task = False
-    
-    # 1. 检查并优先处理失败队列
-    failed_timestamps = read_failed_log(args.data_dir)
-    if failed_timestamps:
-        target_timestamp = failed_timestamps[0]
-        print(f"--- 发现失败队列任务，尝试回补: {target_timestamp} ---")
-        is_retry_task = True
-    
-    # 2. 如果没有失败任务，则查找最新任务
-    if not target_timestamp:
-        latest = find_latest_available_timestamp()
-        if latest:
-            target_timestamp = latest
+
+    # 1. 收集本轮的全部目标：失败队列 + 最新可用时间戳
+    failed_queue = get_failed_queue(args.data_dir)
+    failed_timestamps = failed_queue.items()
+    targets = list(failed_timestamps)
+    if targets:
+        print(f"--- 发现 {len(targets)} 个失败队列任务，尝试回补 ---")
+    latest = find_latest_available_timestamp()
+    if latest:
+        if latest not in targets:
+            targets.append(latest)
+    elif not targets:
+        print("当前无可用最新数据。")
+
+    # 2. 多个目标：小批量走阶段流水线；长时间断线攒下的大积压改为
+    # K路全流程并行——各时间戳的输入输出路径天然不相交，互不干扰
+    if len(targets) > 1:
+        parallel_retries = getattr(args, 'parallel_retries', 3)
+        if len(targets) > parallel_retries and parallel_retries > 1:
+            print(f"--- 大积压（{len(targets)}个），以{parallel_retries}路并行回补 ---")
+            results = {}
+            with ThreadPoolExecutor(max_workers=parallel_retries) as executor:
+                futures = {executor.submit(run_workflow_for_timestamp, ts, args): ts for ts in targets}
+                for future in as_completed(futures):
+                    ts = futures[future]
+                    try:
+                        results[ts] = bool(future.result())
+                    except Exception as e:
+                        print(f"[{ts}] 工作流抛出未预料的错误: {e}")
+                        results[ts] = False
         else:
-            print("当前无可用最新数据。")
-            
-    # 3. 如果有任务目标，则执行工作流
+            results = run_workflows_pipelined(targets, args)
+        failed_now = [ts for ts in targets if not results.get(ts, False)]
+        failed_queue.replace(failed_now)
+        print(f"--- 流水线完成：成功 {sum(results.values())} 个，仍失败 {len(failed_now)} 个 ---")
+        print(f"\n--- 本轮计划任务执行完毕 @ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
+        return
+    if targets:
+        target_timestamp = targets[0]
+        is_retry_task = target_timestamp in failed_timestamps
+
+    # 3. 单个目标：沿用顺序工作流
     if target_timestamp:
         success = run_workflow_for_timestamp(target_timestamp, args)
-        
-        # 4. 根据执行结果更新失败日志
-        failed_timestamps = read_failed_log(args.data_dir) # 重新读取以防万一
+
+        # 4. 根据执行结果更新失败队列（内存态，落盘由队列自己保证原子）
         if success:
-            if is_retry_task and target_timestamp in failed_timestamps:
+            if is_retry_task:
                 print(f"--- 成功回补任务 {target_timestamp}，将其从失败队列中移除 ---")
-                failed_timestamps.remove(target_timestamp)
-                write_failed_log(args.data_dir, failed_timestamps)
-        else: # 如果失败了
-            if target_timestamp not in failed_timestamps:
-                print(f"--- 工作流失败，将时间戳 {target_timestamp} 添加到失败队列 ---")
-                failed_timestamps.append(target_timestamp)
-                write_failed_log(args.data_dir, failed_timestamps)
+                failed_queue.remove(target_timestamp)
+        else:
+            print(f"--- 工作流失败，将时间戳 {target_timestamp} 添加到失败队列 ---")
+            failed_queue.add(target_timestamp)
     
     print(f"\n--- 本轮计划任务执行完毕 @ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
 
+def next_noon():
+    """下一个本地时间12:00的datetime；已过今天12:00则取明天的。"""
+    now = datetime.now()
+    target = now.replace(hour=12, minute=0, second=0, microsecond=0)
+    return target if target > now else target + timedelta(days=1)
+
 def main():
     parser = argparse.ArgumentParser(
         description="守护进程：定时获取、处理并切片风云4B卫星图像，并处理失败任务。",
@@ -152,6 +610,14 @@ def main():
     parser.add_argument(
         "--keep-files", action="store_true", help="保留所有中间生成的 PNG 和 TIF 文件。"
     )
+    parser.add_argument(
+        "--parallel-retries", type=int, default=3,
+        help="积压回补时并行处理的时间戳数量上限。默认为 3。"
+    )
+    parser.add_argument(
+        "--use-subprocess", action="store_true",
+        help="每个步骤启动独立的Python子进程（旧行为），用于隔离排查；默认在本进程内直接调用各步骤。"
+    )
     
     args = parser.parse_args()
     os.makedirs(args.data_dir, exist_ok=True)
@@ -162,29 +628,39 @@ def main():
         run_workflow_for_timestamp(args.timestamp, args)
         sys.exit(0)
 
-    # --- 守护进程模式 -> 更改为每日调度模式 ---
+    # --- 守护进程模式 -> 每日调度模式 ---
     print("--- 启动每日调度模式 ---")
     print("任务将在每天 12:00 自动运行。按 Ctrl+C 停止。")
-    
-    # 设置调度任务
-    schedule.every().day.at("12:00").do(run_scheduled_task, args=args)
-    
+
     # (可选) 为了方便测试，可以取消下面这行的注释，让程序启动时立即执行一次任务
     # print("为了方便测试，将立即执行一次任务...")
     # run_scheduled_task(args)
 
-    # 启动调度循环
-    while True:
-        try:
-            schedule.run_pending()
-            time.sleep(1)
-        except KeyboardInterrupt:
-            print("\n检测到 Ctrl+C，正在优雅地关闭调度器...")
-            sys.exit(0)
-        except Exception as e:
-            print(f"\n调度器主循环发生未预料的严重错误: {e}")
-            print("将等待60秒后重试...")
-            time.sleep(60)
+    # 一天一个任务不需要调度库：直接算出下一个12:00的deadline，一觉
+    # 睡到点（每天1次唤醒，替代每秒轮询的86400次）。deadline重算放在
+    # 循环里，系统时钟调整也能自愈。SIGINT保持默认投递：Ctrl+C既能
+    # 打断睡眠，也能中止一个正在执行的任务周期（下载+重投影+切片
+    # 可能长达数十分钟）
+    sleep_event = threading.Event()
+    try:
+        while True:
+            deadline = next_noon()
+            print(f"下一次任务时间: {deadline.strftime('%Y-%m-%d %H:%M:%S')}")
+            while True:
+                remaining = (deadline - datetime.now()).total_seconds()
+                if remaining <= 0:
+                    break
+                sleep_event.wait(timeout=remaining)
+            try:
+                run_scheduled_task(args)
+            except Exception as e:
+                print(f"\n调度器主循环发生未预料的严重错误: {e}")
+                print("将等待60秒后重试...")
+                sleep_event.wait(60)
+    except KeyboardInterrupt:
+        pass
+    print("\n检测到停止信号，正在优雅地关闭调度器...")
+    sys.exit(0)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
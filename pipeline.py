@@ -0,0 +1,76 @@
+import os
+import sys
+import argparse
+import requests
+from osgeo import gdal
+from dotenv import load_dotenv
+
+from download_stitch import HEADERS, download_and_stitch_in_memory
+from georeference_and_reproject import georeference_and_reproject
+
+def canvas_to_mem_dataset(canvas):
+    """把拼接画布包成GDAL MEM数据集，按波段写入，零文件IO。"""
+    height, width = canvas.shape[:2]
+    mem_ds = gdal.GetDriverByName('MEM').Create('', width, height, 3, gdal.GDT_Byte)
+    for band in range(3):
+        mem_ds.GetRasterBand(band + 1).WriteArray(canvas[..., band])
+    return mem_ds
+
+def run_pipeline(timestamp, data_dir, bbox_4326=None, concurrency=10):
+    """
+    单进程一体化流水线：下载瓦片直接拼进内存画布，画布经MEM数据集
+    直接交给GDAL重投影。与分步脚本相比，省去了拼接PNG的编码、落盘
+    和下一级的重新解码（约两遍800MB的zlib往返）。
+    """
+    with requests.Session() as session:
+        session.headers.update(HEADERS)
+        canvas = download_and_stitch_in_memory(session, timestamp, concurrency)
+    if canvas is None:
+        return False
+
+    output_tif = os.path.join(data_dir, f"fy4b_full_disk_{timestamp}_mercator.tif")
+    mem_ds = canvas_to_mem_dataset(canvas)
+    georeference_and_reproject(mem_ds, output_tif, bbox_4326=bbox_4326)
+    mem_ds = None
+    return os.path.exists(output_tif)
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description="Downloads, stitches and reprojects a full-disk image entirely in one process (no intermediate PNG)."
+    )
+    parser.add_argument(
+        '-t', '--timestamp',
+        type=str,
+        required=True,
+        help="要处理的时间戳，格式为 YYYYMMDDHHMMSS。"
+    )
+    parser.add_argument(
+        '-d', '--data-dir', type=str, default='./data', help="输出GeoTIFF的基础目录。默认为 './data'"
+    )
+
+    bbox_group = parser.add_argument_group('Cropping Options (all four must be provided to enable cropping)')
+    bbox_group.add_argument("--north", type=float, help="Northern boundary latitude (e.g., 55.0)")
+    bbox_group.add_argument("--south", type=float, help="Southern boundary latitude (e.g., -55.0)")
+    bbox_group.add_argument("--west", type=float, help="Western boundary longitude (e.g., 60.0)")
+    bbox_group.add_argument("--east", type=float, help="Eastern boundary longitude (e.g., 150.0)")
+
+    args = parser.parse_args()
+
+    bbox_4326 = None
+    if all(arg is not None for arg in [args.north, args.south, args.west, args.east]):
+        bbox_4326 = {
+            "north": args.north,
+            "south": args.south,
+            "west": args.west,
+            "east": args.east
+        }
+
+    concurrency = int(os.getenv('DOWNLOAD_CONCURRENCY', 10))
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    if run_pipeline(args.timestamp, args.data_dir, bbox_4326=bbox_4326, concurrency=concurrency):
+        print("\n✅ Pipeline finished successfully!")
+    else:
+        print("\n❌ Pipeline failed.")
+        sys.exit(1)